@@ -0,0 +1,106 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import engine
+from logic import Logic
+from perft import POSITIONS
+from perft import START_FEN
+from perft import perft
+
+# Positions are shipped to worker processes as FEN strings and moves as coordinate notation,
+# so a worker never receives a pickled Logic
+
+
+# Position after playing one root move (given in coordinate notation) from a FEN
+def _positionAfter(fen, uci):
+    game_state = Logic()
+    game_state.loadFEN(fen)
+    for move in game_state.validMoves():
+        if move.getUCI() == uci:
+            game_state.makeMove(move)
+            return game_state
+    raise ValueError("illegal move %s in %s" % (uci, fen))
+
+
+def _rootMoves(fen):
+    game_state = Logic()
+    game_state.loadFEN(fen)
+    return [move.getUCI() for move in game_state.validMoves()]
+
+
+def _perftJob(job):
+    fen, uci, depth = job
+    return uci, perft(_positionAfter(fen, uci), depth)
+
+
+def _searchJob(job):
+    fen, uci, depth, time_limit = job
+    result = engine.search(_positionAfter(fen, uci), depth, time_limit)
+    return uci, -result.score, [uci] + [move.getUCI() for move in result.pv], result.nodes
+
+
+# Perft divide with the root moves split across worker processes
+def parallelDivide(fen, depth, workers=None):
+    jobs = [(fen, uci, depth - 1) for uci in _rootMoves(fen)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return dict(executor.map(_perftJob, jobs))
+
+
+def parallelPerft(fen, depth, workers=None):
+    return sum(parallelDivide(fen, depth, workers).values())
+
+
+# Search every root move in its own worker, returns (uci, score, pv, nodes) best first
+def parallelAnalyze(fen, depth=None, time_limit=None, workers=None):
+    jobs = [(fen, uci, depth - 1 if depth else None, time_limit) for uci in _rootMoves(fen)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(_searchJob, jobs))
+    results.sort(key=lambda result: result[1], reverse=True)
+    return results
+
+
+# Time parallelPerft with 1 to max_workers workers, returns (workers, seconds, speedup) rows
+def scaling(fen, depth, max_workers):
+    rows = []
+    base = None
+    for workers in range(1, max_workers + 1):
+        start = time.perf_counter()
+        parallelPerft(fen, depth, workers)
+        seconds = time.perf_counter() - start
+        base = base or seconds
+        rows.append((workers, seconds, base / seconds))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Multi-process perft and root move analysis")
+    parser.add_argument("--fen", default=START_FEN)
+    parser.add_argument("--position", choices=sorted(POSITIONS), help="use one of the perft reference positions")
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--analyze", action="store_true", help="search each root move instead of counting nodes")
+    parser.add_argument("--time", type=float, help="time limit per root move when analyzing")
+    parser.add_argument("--scaling", action="store_true", help="report perft speedup from 1 to --workers workers")
+    args = parser.parse_args(argv)
+    fen = POSITIONS[args.position][0] if args.position else args.fen
+
+    if args.scaling:
+        for workers, seconds, speedup in scaling(fen, args.depth, args.workers):
+            print("%2d workers: %7.2fs  speedup %.2fx" % (workers, seconds, speedup))
+    elif args.analyze:
+        for uci, score, pv, nodes in parallelAnalyze(fen, args.depth, args.time, args.workers):
+            print("%-6s %6d  nodes %8d  pv %s" % (uci, score, nodes, " ".join(pv)))
+    else:
+        start = time.perf_counter()
+        counts = parallelDivide(fen, args.depth, args.workers)
+        seconds = time.perf_counter() - start
+        for uci in sorted(counts):
+            print("%s: %d" % (uci, counts[uci]))
+        nodes = sum(counts.values())
+        print("nodes %d  time %.2fs  nps %.0f  workers %d" % (nodes, seconds, nodes / max(seconds, 1e-9), args.workers))
+
+
+if __name__ == "__main__":
+    main()
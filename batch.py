@@ -0,0 +1,194 @@
+import argparse
+import random
+import sys
+import time
+
+import numpy as np
+
+from evaluation import PIECE_VALUES
+from logic import Logic
+
+# Batch features of many positions at once with NumPy
+# A position is an 8x8 int8 array (row 0 is the 8th rank, same as Logic.board): 0 for an empty square,
+# 1..6 for a white pawn, knight, bishop, rook, queen, king and -1..-6 for the black ones
+KINDS = "PNBRQK"
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(1, 7)
+PIECE_CODES = {"--": 0}
+for _code, _kind in enumerate(KINDS, 1):
+    PIECE_CODES["w" + _kind] = _code
+    PIECE_CODES["b" + _kind] = -_code
+CODE_PIECES = {code: piece for piece, code in PIECE_CODES.items()}
+# Material value of every code, indexed by code + 6
+CODE_VALUES = np.array([-PIECE_VALUES[kind] for kind in reversed(KINDS)] + [0]
+                       + [PIECE_VALUES[kind] for kind in KINDS], dtype=np.int32)
+
+KNIGHT_OFFSETS = Logic.knight_directions
+KING_OFFSETS = Logic.king_directions
+ROOK_DIRECTIONS = Logic.rook_directions
+BISHOP_DIRECTIONS = Logic.bishop_directions
+WHITE, BLACK = 0, 1
+
+
+def boardToArray(board):
+    return np.array([[PIECE_CODES[piece] for piece in row] for row in board], dtype=np.int8)
+
+
+def arrayToBoard(array):
+    return [[CODE_PIECES[int(code)] for code in row] for row in array]
+
+
+# N x 8 x 8 int8 batch from a list of Logic.board style boards
+def boardsToBatch(boards):
+    batch = np.empty((len(boards), 8, 8), dtype=np.int8)
+    for i, board in enumerate(boards):
+        batch[i] = boardToArray(board)
+    return batch
+
+
+# Move every square of a N x 8 x 8 array by (dr, dc), squares pushed off the board are dropped
+def shift(array, dr, dc):
+    result = np.zeros_like(array)
+    result[:, max(dr, 0):8 + min(dr, 0), max(dc, 0):8 + min(dc, 0)] = \
+        array[:, max(-dr, 0):8 + min(-dr, 0), max(-dc, 0):8 + min(-dc, 0)]
+    return result
+
+
+# White minus black material of every position, in centipawns
+def material(batch):
+    return CODE_VALUES[batch.astype(np.int32) + 6].sum(axis=(1, 2))
+
+
+# Squares reached from every piece of a set by single steps, one N x 8 x 8 bool map per offset
+def _steps(pieces, offsets):
+    return [shift(pieces, dr, dc) for dr, dc in offsets]
+
+
+# Squares reached by sliders along each direction, stopping on (and including) the first occupied square
+def _rays(sliders, empty, directions):
+    rays = []
+    for dr, dc in directions:
+        ray = shift(sliders, dr, dc)
+        reached = ray.copy()
+        for _ in range(6):
+            ray = shift(ray & empty, dr, dc)
+            if not ray.any():
+                break
+            reached |= ray
+        rays.append(reached)
+    return rays
+
+
+# Per color attack maps and pseudo-legal move counts (castling and en passant aside, promotions count 4)
+# Returns (attacks N x 2 x 8 x 8 bool, mobility N x 2 int32), index 0 is white and 1 is black
+def attacksAndMobility(batch):
+    n = len(batch)
+    empty = batch == 0
+    occupied = [batch > 0, batch < 0]
+    attacks = np.zeros((n, 2, 8, 8), dtype=bool)
+    mobility = np.zeros((n, 2), dtype=np.int32)
+    for color, sign in ((WHITE, 1), (BLACK, -1)):
+        own = occupied[color]
+        enemy = occupied[1 - color]
+        pieces = batch * sign
+        targets = (_steps(pieces == KNIGHT, KNIGHT_OFFSETS) + _steps(pieces == KING, KING_OFFSETS)
+                   + _rays((pieces == ROOK) | (pieces == QUEEN), empty, ROOK_DIRECTIONS)
+                   + _rays((pieces == BISHOP) | (pieces == QUEEN), empty, BISHOP_DIRECTIONS))
+        # pawns attack diagonally forward but only move there to capture
+        forward = -1 if color == WHITE else 1
+        pawns = pieces == PAWN
+        pawn_attacks = [shift(pawns, forward, -1), shift(pawns, forward, 1)]
+        for reached in targets + pawn_attacks:
+            attacks[:, color] |= reached
+        for reached in targets:
+            mobility[:, color] += (reached & ~own).sum(axis=(1, 2))
+        single = shift(pawns, forward, 0) & empty
+        start_rank = 5 if color == WHITE else 2 # rank a double push passes through
+        double = shift(single & (np.arange(8) == start_rank)[:, None], forward, 0) & empty
+        promotion_rank = 0 if color == WHITE else 7
+        for reached in [single] + [capture & enemy for capture in pawn_attacks]:
+            promotions = reached[:, promotion_rank].sum(axis=1)
+            mobility[:, color] += reached.sum(axis=(1, 2)) + 3 * promotions
+        mobility[:, color] += double.sum(axis=(1, 2))
+    return attacks, mobility
+
+
+# Material, mobility and attack maps of a whole batch
+def analyzeBatch(batch):
+    attacks, mobility = attacksAndMobility(batch)
+    return material(batch), mobility, attacks
+
+
+# The same features for one position through Logic (possibleMoves per side), for comparison
+def analyzePosition(game_state):
+    score = sum(PIECE_VALUES[piece[1]] * (1 if piece[0] == "w" else -1)
+                for row in game_state.board for piece in row if piece != "--")
+    white_to_move = game_state.white_to_move
+    mobility = []
+    attacks = []
+    for color_white in (True, False):
+        game_state.white_to_move = color_white
+        mobility.append(sum(1 for move in game_state.possibleMoves() if not move.enpassant_move))
+        game_state.white_to_move = not color_white # attackedSquares looks at the side not to move
+        attacks.append(game_state.attackedSquares())
+    game_state.white_to_move = white_to_move
+    return score, mobility, attacks
+
+
+# Boards seen along random games, a reproducible source of benchmark positions
+def randomBoards(count, seed=0, max_plies=120):
+    rng = random.Random(seed)
+    boards = []
+    while len(boards) < count:
+        game_state = Logic()
+        for _ in range(max_plies):
+            moves = game_state.validMoves()
+            if not moves or len(boards) >= count:
+                break
+            game_state.makeMove(rng.choice(moves))
+            boards.append([row[:] for row in game_state.board])
+    return boards
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch material, mobility and attack maps with NumPy")
+    parser.add_argument("--positions", type=int, default=5000, help="positions taken from random games")
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--check", action="store_true", help="compare every position with the Logic path")
+    args = parser.parse_args(argv)
+
+    boards = randomBoards(args.positions, args.seed)
+    start = time.perf_counter()
+    batch = boardsToBatch(boards)
+    convert_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(0, len(batch), args.batch_size):
+        analyzeBatch(batch[i:i + args.batch_size])
+    batch_seconds = max(time.perf_counter() - start, 1e-9)
+    game_state = Logic()
+    start = time.perf_counter()
+    for board in boards:
+        game_state.board = board
+        analyzePosition(game_state)
+    logic_seconds = max(time.perf_counter() - start, 1e-9)
+
+    print("%d positions (int8 conversion %.0f positions/sec)" % (len(boards), len(boards) / max(convert_seconds, 1e-9)))
+    print("numpy batch: %10.0f positions/sec" % (len(boards) / batch_seconds))
+    print("logic:       %10.0f positions/sec  (%.1fx slower)" % (len(boards) / logic_seconds,
+                                                                  logic_seconds / batch_seconds))
+    if args.check:
+        scores, mobility, attacks = analyzeBatch(batch)
+        mismatches = 0
+        for i, board in enumerate(boards):
+            game_state.board = board
+            score, logic_mobility, logic_attacks = analyzePosition(game_state)
+            if score != scores[i] or logic_mobility != list(mobility[i]) \
+                    or logic_attacks != attacks[i].tolist():
+                mismatches += 1
+        print("%d mismatches" % mismatches)
+        return 1 if mismatches else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,346 @@
+from logic import BKS
+from logic import BQS
+from logic import Logic
+from logic import Move
+from logic import WKS
+from logic import WQS
+
+# Square index is row * 8 + col, so bit 0 is a8 and bit 63 is h1 (same layout as Logic.board)
+PIECES = ["wP", "wN", "wB", "wR", "wQ", "wK", "bP", "bN", "bB", "bR", "bQ", "bK"]
+PIECE_INDEX = {piece: i for i, piece in enumerate(PIECES)}
+WHITE, BLACK = 0, 1
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+
+ROOK_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+BISHOP_DIRECTIONS = ((-1, 1), (1, -1), (1, 1), (-1, -1))
+KNIGHT_OFFSETS = ((1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2))
+KING_OFFSETS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+
+
+def _bit(r, c):
+    return 1 << (r * 8 + c)
+
+
+# Squares reached by single steps from every square
+def _stepTable(offsets):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        mask = 0
+        for dr, dc in offsets:
+            if 0 <= r + dr < 8 and 0 <= c + dc < 8:
+                mask |= _bit(r + dr, c + dc)
+        table.append(mask)
+    return table
+
+
+# Full ray from every square in one direction (excluding the square itself)
+def _rayTable(dr, dc):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        mask = 0
+        r, c = r + dr, c + dc
+        while 0 <= r < 8 and 0 <= c < 8:
+            mask |= _bit(r, c)
+            r, c = r + dr, c + dc
+        table.append(mask)
+    return table
+
+
+KNIGHT_ATTACKS = _stepTable(KNIGHT_OFFSETS)
+KING_ATTACKS = _stepTable(KING_OFFSETS)
+# PAWN_ATTACKS[color][sq] are the squares a pawn of that color on sq attacks
+PAWN_ATTACKS = [_stepTable(((-1, -1), (-1, 1))), _stepTable(((1, -1), (1, 1)))]
+# Rays paired with whether they run towards higher square indexes
+ROOK_RAYS = [(_rayTable(dr, dc), dr > 0 or (dr == 0 and dc > 0)) for dr, dc in ROOK_DIRECTIONS]
+BISHOP_RAYS = [(_rayTable(dr, dc), dr > 0) for dr, dc in BISHOP_DIRECTIONS]
+
+ALL_SQUARES = (1 << 64) - 1
+
+
+# Squares strictly between two squares on a common rank, file or diagonal (0 when there is no line)
+def _betweenTable():
+    table = [[0] * 64 for _ in range(64)]
+    for sq in range(64):
+        for dr, dc in KING_OFFSETS:
+            r, c = divmod(sq, 8)
+            mask = 0
+            r, c = r + dr, c + dc
+            while 0 <= r < 8 and 0 <= c < 8:
+                table[sq][r * 8 + c] = mask
+                mask |= _bit(r, c)
+                r, c = r + dr, c + dc
+    return table
+
+
+BETWEEN = _betweenTable()
+
+
+# Attacks of a slider along a set of rays, stopping at the first blocker
+def _slidingAttacks(sq, occupied, rays):
+    attacks = 0
+    for table, positive in rays:
+        ray = table[sq]
+        blockers = ray & occupied
+        if blockers:
+            if positive:
+                first = (blockers & -blockers).bit_length() - 1
+            else:
+                first = blockers.bit_length() - 1
+            ray ^= table[first]
+        attacks |= ray
+    return attacks
+
+
+def rookAttacks(sq, occupied):
+    return _slidingAttacks(sq, occupied, ROOK_RAYS)
+
+
+def bishopAttacks(sq, occupied):
+    return _slidingAttacks(sq, occupied, BISHOP_RAYS)
+
+
+def _squares(bits):
+    while bits:
+        lsb = bits & -bits
+        yield lsb.bit_length() - 1
+        bits ^= lsb
+
+
+# Logic with the pieces also kept as one 64-bit integer per piece type and color
+# Moves are generated from the bitboards, everything else (the string board the GUI draws, zobrist key,
+# evaluation, draw tracking, FEN, undo stack) is the Logic state, kept up to date by Logic.makeMove
+class BitboardLogic(Logic):
+    # Initializes the game of chess from the starting position
+    def __init__(self):
+        Logic.__init__(self)
+        self.setBitboards()
+
+    # Set up the position from a FEN string
+    def loadFEN(self, fen):
+        Logic.loadFEN(self, fen)
+        self.setBitboards()
+
+    # Build the bitboards from the string board
+    def setBitboards(self):
+        self.bitboards = [0] * 12
+        self.occupied = [0, 0]
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    self.bitboards[PIECE_INDEX[piece]] |= _bit(r, c)
+                    self.occupied[WHITE if piece[0] == "w" else BLACK] |= _bit(r, c)
+
+    # Flip the bits a move changes, the same flips make and take back the move
+    def toggleMove(self, move):
+        bb = self.bitboards
+        occupied = self.occupied
+        moved = PIECE_INDEX[move.piece_moved]
+        color = WHITE if moved < 6 else BLACK
+        start = 1 << (move.start_row * 8 + move.start_col)
+        end = 1 << (move.end_row * 8 + move.end_col)
+        if move.pawn_promotion:
+            bb[moved] ^= start
+            bb[PIECE_INDEX[move.piece_moved[0] + move.promotion_piece]] ^= end
+        else:
+            bb[moved] ^= start | end
+        occupied[color] ^= start | end
+        if move.piece_captured != "--":
+            captured = 1 << (move.start_row * 8 + move.end_col) if move.enpassant_move else end
+            bb[PIECE_INDEX[move.piece_captured]] ^= captured
+            occupied[1 - color] ^= captured
+        if move.castle_move:
+            if move.end_col - move.start_col == 2:  # king side castle
+                rook = (end << 1) | (end >> 1)
+            else:  # queen side castle
+                rook = (end >> 2) | (end << 1)
+            bb[color * 6 + ROOK] ^= rook
+            occupied[color] ^= rook
+
+    # Takes a move and makes it (including castling, en passant and pawn promotion)
+    def makeMove(self, move):
+        self.toggleMove(move)
+        Logic.makeMove(self, move)
+
+    # Undo the last move made by a player
+    def undoMove(self):
+        if len(self.move_log) != 0:
+            self.toggleMove(self.move_log[-1])
+            Logic.undoMove(self)
+
+    # Pieces of a color attacking a square, with the given occupancy
+    def attackersOf(self, sq, by_color, occupied):
+        bb = self.bitboards
+        base = by_color * 6
+        queens = bb[base + QUEEN]
+        return (KNIGHT_ATTACKS[sq] & bb[base + KNIGHT]) | (PAWN_ATTACKS[1 - by_color][sq] & bb[base + PAWN]) \
+            | (KING_ATTACKS[sq] & bb[base + KING]) | (bishopAttacks(sq, occupied) & (bb[base + BISHOP] | queens)) \
+            | (rookAttacks(sq, occupied) & (bb[base + ROOK] | queens))
+
+    # Determines if a square is attacked by the given color
+    def squareAttacked(self, sq, by_color, occupied=None):
+        if occupied is None:
+            occupied = self.occupied[WHITE] | self.occupied[BLACK]
+        return self.attackersOf(sq, by_color, occupied) != 0
+
+    # Determines if the enemy can attack a specific square (r,c)
+    def squareUnderAttack(self, r, c):
+        return self.squareAttacked(r * 8 + c, BLACK if self.white_to_move else WHITE)
+
+    # Determines if the current player is in check
+    def inCheck(self):
+        color = WHITE if self.white_to_move else BLACK
+        king = self.bitboards[color * 6 + KING]
+        return self.squareAttacked(king.bit_length() - 1, 1 - color)
+
+    # Legal moves from the checks and pins of the position, without making any move
+    # captures_only keeps captures and promotions and skips castling, for the quiescence search
+    def legalMoves(self, captures_only=False):
+        color = WHITE if self.white_to_move else BLACK
+        enemy_color = 1 - color
+        bb = self.bitboards
+        base = color * 6
+        enemy_base = enemy_color * 6
+        own = self.occupied[color]
+        enemy = self.occupied[enemy_color]
+        occupied = own | enemy
+        king = bb[base + KING].bit_length() - 1
+        checkers = self.attackersOf(king, enemy_color, occupied)
+        moves = []
+        if not checkers & (checkers - 1):  # only the king can answer a double check
+            # a piece alone between the king and an enemy slider may only move along that line
+            pins = {}
+            enemy_queens = bb[enemy_base + QUEEN]
+            for rays, sliders in ((ROOK_RAYS, bb[enemy_base + ROOK] | enemy_queens),
+                                  (BISHOP_RAYS, bb[enemy_base + BISHOP] | enemy_queens)):
+                for slider in _squares(_slidingAttacks(king, enemy, rays) & sliders):
+                    blockers = BETWEEN[king][slider] & own
+                    if blockers and not blockers & (blockers - 1):
+                        pins[blockers.bit_length() - 1] = BETWEEN[king][slider] | (1 << slider)
+            # squares that capture the checker or block its line
+            if checkers:
+                checker = checkers.bit_length() - 1
+                evasions = checkers | BETWEEN[king][checker]
+            else:
+                evasions = ALL_SQUARES
+            targets = (enemy if captures_only else ~own) & evasions
+            self._pawnMoves(color, occupied, enemy, evasions, pins, captures_only, moves)
+            for sq in _squares(bb[base + KNIGHT]):
+                if sq not in pins:  # a pinned knight can't stay on the line
+                    self._addMoves(sq, KNIGHT_ATTACKS[sq] & targets, moves)
+            queens = bb[base + QUEEN]
+            for sq in _squares(bb[base + BISHOP] | queens):
+                self._addMoves(sq, bishopAttacks(sq, occupied) & targets & pins.get(sq, ALL_SQUARES), moves)
+            for sq in _squares(bb[base + ROOK] | queens):
+                self._addMoves(sq, rookAttacks(sq, occupied) & targets & pins.get(sq, ALL_SQUARES), moves)
+        # the king is lifted so it can't hide behind itself
+        without_king = occupied ^ (1 << king)
+        for sq in _squares(KING_ATTACKS[king] & (enemy if captures_only else ~own)):
+            if not self.attackersOf(sq, enemy_color, without_king):
+                self._addMoves(king, 1 << sq, moves)
+        if not checkers and not captures_only:
+            self.getCastleMoves(king >> 3, king & 7, moves)
+        return moves
+
+    # Obtain all of the moves whithout considering checks (castling excluded)
+    def possibleMoves(self):
+        moves = []
+        color = WHITE if self.white_to_move else BLACK
+        base = color * 6
+        bb = self.bitboards
+        own = self.occupied[color]
+        enemy = self.occupied[1 - color]
+        occupied = own | enemy
+        not_own = ~own
+        self._pawnMoves(color, occupied, enemy, ALL_SQUARES, {}, False, moves)
+        for sq in _squares(bb[base + KNIGHT]):
+            self._addMoves(sq, KNIGHT_ATTACKS[sq] & not_own, moves)
+        for sq in _squares(bb[base + BISHOP]):
+            self._addMoves(sq, bishopAttacks(sq, occupied) & not_own, moves)
+        for sq in _squares(bb[base + ROOK]):
+            self._addMoves(sq, rookAttacks(sq, occupied) & not_own, moves)
+        for sq in _squares(bb[base + QUEEN]):
+            self._addMoves(sq, (rookAttacks(sq, occupied) | bishopAttacks(sq, occupied)) & not_own, moves)
+        for sq in _squares(bb[base + KING]):
+            self._addMoves(sq, KING_ATTACKS[sq] & not_own, moves)
+        return moves
+
+    def _addMoves(self, start, targets, moves):
+        board = self.board
+        r, c = start >> 3, start & 7
+        piece = board[r][c]
+        for end in _squares(targets):
+            end_row, end_col = end >> 3, end & 7
+            moves.append(Move.fromSquares(r, c, end_row, end_col, piece, board[end_row][end_col]))
+
+    # Get the pawn moves ending on evasions, pinned pawns only move along their pin line
+    def _pawnMoves(self, color, occupied, enemy, evasions, pins, captures_only, moves):
+        pawns = self.bitboards[color * 6 + PAWN]
+        empty = ~occupied
+        step = -8 if color == WHITE else 8
+        start_row, last_row = (6, 0) if color == WHITE else (1, 7)
+        pawn, enemy_pawn = ("wP", "bP") if color == WHITE else ("bP", "wP")
+        for sq in _squares(pawns):
+            r, c = sq >> 3, sq & 7
+            allowed = evasions & pins.get(sq, ALL_SQUARES)
+            one = sq + step
+            if (empty >> one) & 1 and (not captures_only or one >> 3 == last_row):
+                if (allowed >> one) & 1:
+                    self._addPawnMove(sq, one, moves)
+                two = one + step
+                if r == start_row and not captures_only and (empty >> two) & 1 and (allowed >> two) & 1:
+                    moves.append(Move.fromSquares(r, c, two >> 3, c, pawn, "--"))
+            captures = PAWN_ATTACKS[color][sq]
+            for end in _squares(captures & enemy & allowed):
+                self._addPawnMove(sq, end, moves)
+            if self.enpassant and captures & _bit(*self.enpassant):
+                move = Move.fromSquares(r, c, self.enpassant[0], self.enpassant[1], pawn, enemy_pawn,
+                                        enpassant_move=True)
+                if self._enpassantLegal(move, color):
+                    moves.append(move)
+
+    # En passant removes two pawns from one rank, so test the king against the resulting occupancy
+    def _enpassantLegal(self, move, color):
+        bb = self.bitboards
+        enemy_base = (1 - color) * 6
+        captured = _bit(move.start_row, move.end_col)
+        occupied = (self.occupied[WHITE] | self.occupied[BLACK]) ^ _bit(move.start_row, move.start_col) \
+            ^ captured ^ _bit(move.end_row, move.end_col)
+        king = bb[color * 6 + KING].bit_length() - 1
+        queens = bb[enemy_base + QUEEN]
+        return not (KNIGHT_ATTACKS[king] & bb[enemy_base + KNIGHT]) \
+            and not (PAWN_ATTACKS[color][king] & bb[enemy_base + PAWN] & ~captured) \
+            and not (bishopAttacks(king, occupied) & (bb[enemy_base + BISHOP] | queens)) \
+            and not (rookAttacks(king, occupied) & (bb[enemy_base + ROOK] | queens))
+
+    def _addPawnMove(self, start, end, moves):
+        r, c = start >> 3, start & 7
+        end_row, end_col = end >> 3, end & 7
+        piece = self.board[r][c]
+        captured = self.board[end_row][end_col]
+        if end_row == 0 or end_row == 7:
+            for promotion_piece in Move.promotion_pieces:
+                moves.append(Move.fromSquares(r, c, end_row, end_col, piece, captured, promotion_piece=promotion_piece))
+        else:
+            moves.append(Move.fromSquares(r, c, end_row, end_col, piece, captured))
+
+    # Generate all valid castle moves for the king on (r,c)
+    def getCastleMoves(self, r, c, moves):
+        if self.white_to_move:
+            kingside, queenside, enemy = WKS, WQS, BLACK
+        else:
+            kingside, queenside, enemy = BKS, BQS, WHITE
+        if not self.castling_rights & (kingside | queenside):
+            return
+        king = r * 8 + c
+        if self.squareAttacked(king, enemy):
+            return  # can't castle out of check
+        occupied = self.occupied[WHITE] | self.occupied[BLACK]
+        if self.castling_rights & kingside and not occupied & (0b11 << (king + 1)):
+            if not self.squareAttacked(king + 1, enemy) and not self.squareAttacked(king + 2, enemy):
+                moves.append(Move.fromSquares(r, c, r, c + 2, self.board[r][c], "--", castle_move=True))
+        if self.castling_rights & queenside and not occupied & (0b111 << (king - 3)):
+            if not self.squareAttacked(king - 1, enemy) and not self.squareAttacked(king - 2, enemy):
+                moves.append(Move.fromSquares(r, c, r, c - 2, self.board[r][c], "--", castle_move=True))
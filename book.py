@@ -0,0 +1,141 @@
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+
+from logic import Logic
+from pgn import PGNError
+from pgn import readGames
+from pgn import resolveSAN
+from pgn import sanTokens
+
+# Book file: an 8 byte header, then entries sorted by position key
+# Each entry is (zobrist key, Move.moveID, weight) packed big-endian in 12 bytes
+MAGIC = b"CHBK"
+VERSION = 1
+HEADER = struct.Struct(">4sI")
+ENTRY = struct.Struct(">QHH")
+KEY = struct.Struct(">Q")
+
+
+class OpeningBook():
+
+    # Memory-maps the book, nothing is parsed up front
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not an opening book" % path)
+        self.count = (len(self.map) - HEADER.size) // ENTRY.size
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def keyAt(self, index):
+        return KEY.unpack_from(self.map, HEADER.size + index * ENTRY.size)[0]
+
+    # (moveID, weight) pairs stored for a position key, found by binary search
+    def entries(self, key):
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.keyAt(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        found = []
+        while low < self.count:
+            entry_key, move_id, weight = ENTRY.unpack_from(self.map, HEADER.size + low * ENTRY.size)
+            if entry_key != key:
+                break
+            found.append((move_id, weight))
+            low += 1
+        return found
+
+    # Legal book moves of the position as (move, weight), heaviest first
+    def lookup(self, game_state):
+        entries = self.entries(game_state.zobrist_key)
+        if not entries:
+            return []
+        moves = {move.moveID: move for move in game_state.generateMoves()}
+        found = [(moves[move_id], weight) for move_id, weight in entries if move_id in moves]
+        found.sort(key=lambda entry: entry[1], reverse=True)
+        return found
+
+    # Book move picked at random in proportion to its weight, None when out of book
+    def pickMove(self, game_state, rng=random):
+        found = self.lookup(game_state)
+        if not found:
+            return None
+        choice = rng.uniform(0, sum(weight for _, weight in found))
+        for move, weight in found:
+            choice -= weight
+            if choice <= 0:
+                return move
+        return found[-1][0]
+
+
+# Count how often each move is played from each position in the first max_plies of every game
+def collectMoves(source, max_plies=20, use_mmap=False):
+    counts = {}
+    games = 0
+    for tags, movetext in readGames(source, use_mmap):
+        games += 1
+        game_state = Logic()
+        if "FEN" in tags:
+            game_state.loadFEN(tags["FEN"])
+        for san in sanTokens(movetext)[:max_plies]:
+            try:
+                move = resolveSAN(game_state, san)
+            except PGNError:
+                break
+            entry = (game_state.zobrist_key, move.moveID)
+            counts[entry] = counts.get(entry, 0) + 1
+            game_state.makeMove(move)
+    return counts, games
+
+
+# Write a book file from {(key, moveID): count}, dropping moves played fewer than min_count times
+def writeBook(path, counts, min_count=1):
+    entries = sorted((key, move_id, min(count, 0xFFFF)) for (key, move_id), count in counts.items()
+                     if count >= min_count)
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION))
+        for entry in entries:
+            f.write(ENTRY.pack(*entry))
+    return len(entries)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query an opening book")
+    parser.add_argument("book", help="book file")
+    parser.add_argument("--build", metavar="PGN", help="build the book from the games of a PGN file")
+    parser.add_argument("--plies", type=int, default=20, help="book depth in plies when building")
+    parser.add_argument("--min-count", type=int, default=1, help="drop moves played fewer times")
+    parser.add_argument("--fen", help="position to query (default: start position)")
+    args = parser.parse_args(argv)
+
+    if args.build:
+        start = time.perf_counter()
+        counts, games = collectMoves(args.build, args.plies)
+        entries = writeBook(args.book, counts, args.min_count)
+        print("%d games, %d entries, %d bytes in %.2fs" % (games, entries, os.path.getsize(args.book),
+                                                          time.perf_counter() - start))
+        return 0
+    book = OpeningBook(args.book)
+    game_state = Logic()
+    if args.fen:
+        game_state.loadFEN(args.fen)
+    for move, weight in book.lookup(game_state):
+        print("%s %d" % (move.getUCI(), weight))
+    book.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,339 @@
+import argparse
+import time
+
+from evaluation import PIECE_VALUES
+from logic import Logic
+
+MATE = 100000
+INFINITY = 1000000
+MAX_PLY = 64
+
+# Transposition table bound types
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class SearchResult():
+
+    def __init__(self):
+        self.best_move = None
+        self.pv = [] # principal variation, best_move first
+        self.score = 0 # centipawns for the side to move
+        self.depth = 0 # last fully searched depth
+        self.nodes = 0
+        self.seconds = 0.0
+        self.tt_probes = 0
+        self.tt_hits = 0
+
+    def nps(self):
+        return self.nodes / self.seconds if self.seconds > 0 else 0.0
+
+    def ttHitRate(self):
+        return self.tt_hits / self.tt_probes if self.tt_probes else 0.0
+
+
+# Fixed size hash table of search results keyed by Logic.zobrist_key
+# A slot is replaced when the new entry is searched at least as deep or the old one is from an earlier search
+class TranspositionTable():
+
+    def __init__(self, size=1 << 18):
+        self.size = size
+        self.entries = [None] * size # (key, depth, score, bound, move_id, age)
+        self.age = 0
+        self.probes = 0
+        self.hits = 0
+
+    def probe(self, key):
+        self.probes += 1
+        entry = self.entries[key % self.size]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        return None
+
+    def store(self, key, depth, score, bound, move_id):
+        index = key % self.size
+        entry = self.entries[index]
+        if entry is None or entry[0] == key or entry[5] != self.age or depth >= entry[1]:
+            self.entries[index] = (key, depth, score, bound, move_id, self.age)
+
+    def newSearch(self):
+        self.age += 1
+        self.probes = 0
+        self.hits = 0
+
+
+class Searcher():
+
+    def __init__(self, tt_size=1 << 18):
+        self.tt = TranspositionTable(tt_size)
+        self.tablebase = None
+
+    # Iterative deepening search, returns the result of the deepest completed iteration
+    def search(self, game_state, depth=None, time_limit=None, info=None, book=None, tablebase=None):
+        if book is not None: # book moves are played without searching
+            move = book.pickMove(game_state)
+            if move is not None:
+                result = SearchResult()
+                result.best_move = move
+                result.pv = [move]
+                return result
+        if tablebase is not None: # so are moves of positions in the endgame tables
+            best = tablebase.bestMove(game_state)
+            if best is not None:
+                result = SearchResult()
+                result.best_move = best[0]
+                result.pv = [best[0]]
+                result.score = tableScore(best[1], best[2], 0)
+                return result
+        self.tablebase = tablebase
+        if depth is None:
+            depth = MAX_PLY if time_limit is not None else 4
+        self.game_state = game_state
+        self.root_ply = len(game_state.move_log)
+        self.nodes = 0
+        self.deadline = time.perf_counter() + time_limit if time_limit is not None else None
+        self.killers = [[None, None] for _ in range(MAX_PLY + 1)]
+        self.history = {}
+        self.tt.newSearch()
+        result = SearchResult()
+        start = time.perf_counter()
+        try:
+            if depth == 0: # no full width ply, the position is only settled by the quiescence search
+                if game_state.generateMoves():
+                    result.score = self.quiescence(-INFINITY, INFINITY, 0)
+                else:
+                    result.score = -MATE if game_state.inCheck() else 0
+                result.nodes = self.nodes
+                result.seconds = time.perf_counter() - start
+                if info is not None:
+                    info(result)
+            for current_depth in range(1, depth + 1):
+                score = self.negamax(current_depth, -INFINITY, INFINITY, 0)
+                result.score = score
+                result.depth = current_depth
+                result.pv = self.principalVariation(current_depth)
+                result.best_move = result.pv[0] if result.pv else None
+                result.nodes = self.nodes
+                result.seconds = time.perf_counter() - start
+                if info is not None:
+                    info(result)
+                if abs(score) >= MATE - MAX_PLY: # forced mate found, deeper search can't improve it
+                    break
+        except SearchTimeout:
+            while len(game_state.move_log) > self.root_ply:
+                game_state.undoMove()
+        if result.best_move is None and depth > 0: # out of time before depth 1 finished, take the best ordered move
+            moves = self.orderMoves(game_state.generateMoves(), None, 0)
+            result.best_move = moves[0] if moves else None
+            result.pv = moves[:1]
+        result.nodes = self.nodes
+        result.seconds = time.perf_counter() - start
+        result.tt_probes = self.tt.probes
+        result.tt_hits = self.tt.hits
+        return result
+
+    def checkTime(self):
+        if self.deadline is not None and self.nodes & 31 == 0 and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+
+    # Negamax alpha-beta, scores are for the side to move
+    def negamax(self, depth, alpha, beta, ply):
+        game_state = self.game_state
+        self.nodes += 1
+        self.checkTime()
+        key = game_state.zobrist_key
+        if ply > 0 and (game_state.position_counts[key] >= 2 or game_state.isFiftyMoveRule()
+                        or game_state.isInsufficientMaterial()):
+            return 0 # a repeated position inside the search is scored as the draw it can be forced into
+        if self.tablebase is not None and ply > 0:
+            probe = self.tablebase.probe(game_state)
+            if probe is not None:
+                return tableScore(probe[0], probe[1], ply)
+        entry = self.tt.probe(key)
+        tt_move = None
+        if entry is not None:
+            tt_move = entry[4]
+            if entry[1] >= depth and ply > 0:
+                score = self.scoreFromTT(entry[2], ply)
+                if entry[3] == EXACT:
+                    return score
+                if entry[3] == LOWER and score >= beta:
+                    return score
+                if entry[3] == UPPER and score <= alpha:
+                    return score
+        if depth <= 0:
+            return self.quiescence(alpha, beta, ply)
+        moves = game_state.generateMoves()
+        if len(moves) == 0:
+            return -MATE + ply if game_state.inCheck() else 0
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = None
+        for move in self.orderMoves(moves, tt_move, ply):
+            game_state.makeMove(move)
+            score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+            game_state.undoMove()
+            if score > best_score:
+                best_score = score
+                best_move = move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if move.piece_captured == "--": # quiet move caused a cutoff, remember it
+                    killers = self.killers[min(ply, MAX_PLY)]
+                    if killers[0] != move.moveID:
+                        killers[1] = killers[0]
+                        killers[0] = move.moveID
+                    history_key = (move.piece_moved, move.end_row, move.end_col)
+                    self.history[history_key] = self.history.get(history_key, 0) + depth * depth
+                break
+        if best_score <= original_alpha:
+            bound = UPPER
+        elif best_score >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.tt.store(key, depth, self.scoreToTT(best_score, ply), bound, best_move.moveID)
+        return best_score
+
+    # Search captures only until the position is quiet
+    def quiescence(self, alpha, beta, ply):
+        game_state = self.game_state
+        self.nodes += 1
+        self.checkTime()
+        if game_state.inCheck(): # every evasion is needed to tell a checkmate apart
+            moves = game_state.generateMoves()
+            if len(moves) == 0:
+                return -MATE + ply
+        else: # stalemates are left to the full width search
+            moves = game_state.legalMoves(captures_only=True)
+        stand_pat = game_state.evaluate()
+        if stand_pat >= beta or ply >= MAX_PLY:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+        captures = [move for move in moves if move.piece_captured != "--" or move.pawn_promotion]
+        captures.sort(key=self.captureScore, reverse=True)
+        for move in captures:
+            game_state.makeMove(move)
+            score = -self.quiescence(-beta, -alpha, ply + 1)
+            game_state.undoMove()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    # MVV-LVA: most valuable victim first, then least valuable attacker
+    def captureScore(self, move):
+        score = 10 * PIECE_VALUES[move.piece_captured[1]] - PIECE_VALUES[move.piece_moved[1]] \
+            if move.piece_captured != "--" else 0
+        if move.pawn_promotion:
+            score += PIECE_VALUES[move.promotion_piece]
+        return score
+
+    # Order moves: transposition table move, captures by MVV-LVA, killer moves, then history
+    def orderMoves(self, moves, tt_move, ply):
+        killers = self.killers[min(ply, MAX_PLY)]
+        history = self.history
+
+        def score(move):
+            if move.moveID == tt_move:
+                return 1 << 30
+            if move.piece_captured != "--" or move.pawn_promotion:
+                return (1 << 20) + self.captureScore(move)
+            if move.moveID == killers[0]:
+                return 1 << 19
+            if move.moveID == killers[1]:
+                return (1 << 19) - 1
+            return history.get((move.piece_moved, move.end_row, move.end_col), 0)
+
+        return sorted(moves, key=score, reverse=True)
+
+    # Mate scores are stored relative to the node so they stay valid in other parts of the tree
+    def scoreToTT(self, score, ply):
+        if score >= MATE - MAX_PLY:
+            return score + ply
+        if score <= -MATE + MAX_PLY:
+            return score - ply
+        return score
+
+    def scoreFromTT(self, score, ply):
+        if score >= MATE - MAX_PLY:
+            return score - ply
+        if score <= -MATE + MAX_PLY:
+            return score + ply
+        return score
+
+    # Follow the transposition table moves from the root
+    def principalVariation(self, depth):
+        game_state = self.game_state
+        pv = []
+        for _ in range(depth):
+            entry = self.tt.entries[game_state.zobrist_key % self.tt.size]
+            if entry is None or entry[0] != game_state.zobrist_key:
+                break
+            move = next((m for m in game_state.generateMoves() if m.moveID == entry[4]), None)
+            if move is None:
+                break
+            pv.append(move)
+            game_state.makeMove(move)
+        for _ in pv:
+            game_state.undoMove()
+        return pv
+
+
+_default_searcher = None
+
+
+# Score of a tablebase result (WIN 1, DRAW 0, LOSS -1 with plies to mate) found at a search ply
+def tableScore(result, plies, ply):
+    return result * (MATE - ply - plies)
+
+
+# Search the position for a best move, to a fixed depth or until the time limit (seconds) runs out
+# An opening book (book.OpeningBook) and endgame tables (tablebase.Tablebase) are consulted first when given
+def search(game_state, depth=None, time_limit=None, info=None, book=None, tablebase=None):
+    global _default_searcher
+    if _default_searcher is None:
+        _default_searcher = Searcher()
+    return _default_searcher.search(game_state, depth, time_limit, info, book, tablebase)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search a position for the best move")
+    parser.add_argument("--fen", help="position to search (default: start position)")
+    parser.add_argument("--depth", type=int)
+    parser.add_argument("--time", type=float, help="time limit in seconds")
+    parser.add_argument("--book", help="opening book to try before searching")
+    parser.add_argument("--tablebase", help="directory of endgame tables to probe")
+    args = parser.parse_args(argv)
+
+    game_state = Logic()
+    if args.fen:
+        game_state.loadFEN(args.fen)
+
+    def info(result):
+        print("depth %d score %d nodes %d nps %.0f pv %s"
+              % (result.depth, result.score, result.nodes, result.nps(),
+                 " ".join(move.getUCI() for move in result.pv)))
+
+    book = None
+    if args.book:
+        from book import OpeningBook
+        book = OpeningBook(args.book)
+    tablebase = None
+    if args.tablebase:
+        from tablebase import Tablebase
+        tablebase = Tablebase(args.tablebase)
+    result = search(game_state, args.depth, args.time, info, book, tablebase)
+    print("bestmove %s  tt hit rate %.1f%%" % (result.best_move.getUCI() if result.best_move else "(none)",
+                                              100 * result.ttHitRate()))
+
+
+if __name__ == "__main__":
+    main()
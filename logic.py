@@ -1,4 +1,53 @@
+import random
+
+from evaluation import EG_VALUES
+from evaluation import MG_VALUES
+from evaluation import PIECE_PHASE
+from evaluation import evaluateBoard
+from evaluation import taper
+
+# Zobrist keys, seeded so hashes are the same in every run and process
+_zobrist_random = random.Random(0x5EED)
+ZOBRIST_PIECES = {color + kind: [_zobrist_random.getrandbits(64) for _ in range(64)]
+                  for color in "wb" for kind in "PRNBQK"}
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+ZOBRIST_CASTLING = {right: _zobrist_random.getrandbits(64) for right in ("wks","bks","wqs","bqs")}
+ZOBRIST_ENPASSANT = [_zobrist_random.getrandbits(64) for _ in range(8)] # one per file
+
+# Castling rights as bits of one small int (same layout as bitboard.py)
+WKS, WQS, BKS, BQS = 1, 2, 4, 8
+ALL_CASTLING = WKS | WQS | BKS | BQS
+# Hash of every combination of castling rights
+ZOBRIST_CASTLING_BITS = [(ZOBRIST_CASTLING["wks"] if bits & WKS else 0) ^ (ZOBRIST_CASTLING["wqs"] if bits & WQS else 0)
+                         ^ (ZOBRIST_CASTLING["bks"] if bits & BKS else 0) ^ (ZOBRIST_CASTLING["bqs"] if bits & BQS else 0)
+                         for bits in range(16)]
+# Rights kept when a piece leaves or lands on a square (index row * 8 + col)
+CASTLING_MASK = [ALL_CASTLING] * 64
+CASTLING_MASK[7 * 8 + 4] = BKS | BQS # white king
+CASTLING_MASK[7 * 8 + 7] = ALL_CASTLING & ~WKS
+CASTLING_MASK[7 * 8 + 0] = ALL_CASTLING & ~WQS
+CASTLING_MASK[0 * 8 + 4] = WKS | WQS # black king
+CASTLING_MASK[0 * 8 + 7] = ALL_CASTLING & ~BKS
+CASTLING_MASK[0 * 8 + 0] = ALL_CASTLING & ~BQS
+# Home row, rook column and color each castling right needs
+CASTLING_HOMES = {WKS: (7, 7, "w"), WQS: (7, 0, "w"), BKS: (0, 7, "b"), BQS: (0, 0, "b")}
+# One shared (row, col) tuple per square, so moves never build new ones
+SQUARES = [(sq >> 3, sq & 7) for sq in range(64)]
+
+# Undo stack: one frame of UNDO_FRAME slots per ply holding the state a move can't give back
+# (castling bits, en passant square, captured piece, halfmove clock, mg, eg, phase), the zobrist key
+# comes back from hash_history. The stack holds every ply of the game plus the search below it:
+# UNDO_PLIES are preallocated (a typical 80 ply game and a search) and it doubles when a game runs longer
+UNDO_FRAME = 7
+UNDO_PLIES = 96
+
+
 class Logic():
+    rook_directions = ((-1,0),(0,-1),(1,0),(0,1))
+    bishop_directions = ((-1,1),(1,-1),(1,1),(-1,-1))
+    knight_directions = ((1,2),(2,1),(2,-1),(1,-2),(-1,-2),(-2,-1),(-2,1),(-1,2))
+    king_directions = rook_directions + bishop_directions
+
     # Initializes the game of chess
     def __init__(self):
         self.board = [
@@ -12,9 +61,8 @@ class Logic():
             ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"],
         ]
         self.white_to_move = True
+        self.pin_aware = True # generate legal moves from checks and pins instead of make/undo filtering
         self.move_log = []
-        self.move_functions = {"P":self.getPawnMoves,"R":self.getRookMoves,"N":self.getKnightMoves,\
-                               "B":self.getBishopMoves, "Q":self.getQueenMoves,"K":self.getKingMoves }
         # Keep track of king location
         self.white_king_location = (7,4) 
         self.black_king_location = (0,4)
@@ -22,71 +70,271 @@ class Logic():
         self.stale_mate = False
         # coordinates for square where en passant is possible
         self.enpassant = ()
-        self.current_castling = CastleRights(True,True,True,True)
-        self.castleRightsLog = [CastleRights(self.current_castling.wks,self.current_castling.bks,
-                                             self.current_castling.wqs,self.current_castling.bqs)]
+        self.castling_rights = ALL_CASTLING # WKS/WQS/BKS/BQS bits
+        self.undo_stack = [None] * (UNDO_FRAME * UNDO_PLIES)
+        self.undo_top = 0 # index of the next free frame slot
+        self.start_ply = 0 # plies played before the first move in move_log (from a loaded FEN)
+        self.debug_hash = False # compare the incremental zobrist key with a full recompute after every move
+        self.zobrist_key = self.computeZobrist()
+        # material and piece-square scores (white's point of view) and game phase, updated by every move
+        self.debug_eval = False # compare the incremental evaluation with a full recompute after every move
+        self.mg_score, self.eg_score, self.phase = evaluateBoard(self.board)
+        self.resetDrawTracking(0)
         
+    # Set up the position from a FEN string (ex. "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
+    def loadFEN(self,fen):
+        fields = fen.split()
+        self.board = []
+        for rank in fields[0].split("/"):
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row.extend(["--"] * int(char))
+                else:
+                    row.append(("w" if char.isupper() else "b") + char.upper())
+            self.board.append(row)
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c] == "wK":
+                    self.white_king_location = SQUARES[r * 8 + c]
+                elif self.board[r][c] == "bK":
+                    self.black_king_location = SQUARES[r * 8 + c]
+        self.white_to_move = len(fields) < 2 or fields[1] == "w"
+        castling = fields[2] if len(fields) > 2 else "-"
+        self.castling_rights = (WKS if "K" in castling else 0) | (WQS if "Q" in castling else 0) \
+                             | (BKS if "k" in castling else 0) | (BQS if "q" in castling else 0)
+        for right, (row, rook_col, color) in CASTLING_HOMES.items(): # a right needs its king and rook at home
+            if self.board[row][4] != color + "K" or self.board[row][rook_col] != color + "R":
+                self.castling_rights &= ~right
+        if len(fields) > 3 and fields[3] != "-":
+            self.enpassant = SQUARES[Move.ranks_to_rows[fields[3][1]] * 8 + Move.files_to_cols[fields[3][0]]]
+        else:
+            self.enpassant = ()
+        self.undo_top = 0
+        fullmove = int(fields[5]) if len(fields) > 5 else 1
+        self.start_ply = 2 * (fullmove - 1) + (0 if self.white_to_move else 1)
+        self.move_log = []
+        self.check_mate = False
+        self.stale_mate = False
+        self.zobrist_key = self.computeZobrist()
+        self.mg_score, self.eg_score, self.phase = evaluateBoard(self.board)
+        self.resetDrawTracking(int(fields[4]) if len(fields) > 4 else 0)
+
+    # Export the position as a FEN string
+    def getFEN(self):
+        ranks = []
+        for row in self.board:
+            rank = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += piece[1] if piece[0] == "w" else piece[1].lower()
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+        castling = ("K" if self.castling_rights & WKS else "") + ("Q" if self.castling_rights & WQS else "") + \
+                   ("k" if self.castling_rights & BKS else "") + ("q" if self.castling_rights & BQS else "")
+        enpassant = Move.cols_to_files[self.enpassant[1]] + Move.rows_to_ranks[self.enpassant[0]] if self.enpassant else "-"
+        fullmove = (self.start_ply + len(self.move_log)) // 2 + 1
+        return "%s %s %s %s %d %d" % ("/".join(ranks), "w" if self.white_to_move else "b",
+                                      castling or "-", enpassant, self.halfmove_clock, fullmove)
+
+    # Start the repetition history, halfmove clock and piece counts from the current position
+    def resetDrawTracking(self,halfmove_clock):
+        self.hash_history = [self.zobrist_key] # key of every position of the game, pushed by makeMove
+        self.position_counts = {self.zobrist_key: 1} # how often each key occurs in hash_history
+        self.halfmove_clock = halfmove_clock # plies since the last capture or pawn move (restored by the undo stack)
+        self.piece_counts = {}
+        for row in self.board:
+            for piece in row:
+                if piece != "--":
+                    self.piece_counts[piece] = self.piece_counts.get(piece,0) + 1
+
+    # Push the draw tracking state after a move is made
+    def pushDrawTracking(self,move):
+        if move.piece_moved[1] == "P" or move.piece_captured != "--":
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if move.piece_captured != "--":
+            self.piece_counts[move.piece_captured] -= 1
+        if move.pawn_promotion:
+            self.piece_counts[move.piece_moved] -= 1
+            promoted = move.piece_moved[0] + move.promotion_piece
+            self.piece_counts[promoted] = self.piece_counts.get(promoted,0) + 1
+        self.hash_history.append(self.zobrist_key)
+        self.position_counts[self.zobrist_key] = self.position_counts.get(self.zobrist_key,0) + 1
+
+    # Pop the draw tracking state when a move is taken back (before the key is restored)
+    def popDrawTracking(self,move):
+        key = self.hash_history.pop()
+        count = self.position_counts[key] - 1
+        if count:
+            self.position_counts[key] = count
+        else:
+            del self.position_counts[key] # keep only positions still in hash_history
+        if move.piece_captured != "--":
+            self.piece_counts[move.piece_captured] += 1
+        if move.pawn_promotion:
+            self.piece_counts[move.piece_moved] += 1
+            self.piece_counts[move.piece_moved[0] + move.promotion_piece] -= 1
+
+    # The current position has occurred at least three times
+    def isThreefoldRepetition(self):
+        return self.position_counts[self.zobrist_key] >= 3
+
+    # Fifty moves by each side without a capture or pawn move
+    def isFiftyMoveRule(self):
+        return self.halfmove_clock >= 100
+
+    # Neither side can mate: bare kings, a single minor piece, or only bishops all on one square color
+    def isInsufficientMaterial(self):
+        counts = self.piece_counts
+        for piece in ("wP","bP","wR","bR","wQ","bQ"):
+            if counts.get(piece,0):
+                return False
+        minors = counts.get("wN",0) + counts.get("bN",0) + counts.get("wB",0) + counts.get("bB",0)
+        if minors <= 1:
+            return True
+        if counts.get("wN",0) or counts.get("bN",0):
+            return False
+        square_colors = {(r + c) % 2 for r in range(8) for c in range(8) if self.board[r][c][1] == "B"}
+        return len(square_colors) == 1
+
+    # Reason the game is drawn by rule (stalemate aside), None when play goes on
+    def drawReason(self):
+        if self.isThreefoldRepetition():
+            return "threefold repetition"
+        if self.isFiftyMoveRule():
+            return "fifty-move rule"
+        if self.isInsufficientMaterial():
+            return "insufficient material"
+        return None
+
+    # Hash of the castling rights that are still available
+    def castlingKey(self):
+        return ZOBRIST_CASTLING_BITS[self.castling_rights]
+
+    # Hash of the en passant file, only when a pawn of the side to move can capture there
+    # (so a position reached by moves and the same position loaded from FEN hash the same)
+    def enpassantKey(self):
+        if self.enpassant == ():
+            return 0
+        r,c = self.enpassant
+        pawn_row, pawn = (r+1,"wP") if self.white_to_move else (r-1,"bP")
+        if (c-1 >= 0 and self.board[pawn_row][c-1] == pawn) or (c+1 <= 7 and self.board[pawn_row][c+1] == pawn):
+            return ZOBRIST_ENPASSANT[c]
+        return 0
+
+    # Zobrist hash of the position computed from scratch (makeMove/undoMove keep it up to date)
+    def computeZobrist(self):
+        key = 0
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c] != "--":
+                    key ^= ZOBRIST_PIECES[self.board[r][c]][r * 8 + c]
+        if not self.white_to_move:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        key ^= self.enpassantKey()
+        return key ^ self.castlingKey()
+
+    # Debug mode check that the incremental key matches the position
+    def checkZobrist(self):
+        if self.zobrist_key != self.computeZobrist():
+            raise RuntimeError("zobrist key out of sync after " +
+                               " ".join(move.getUCI() for move in self.move_log))
         
     # Takes a move and makes it (Except. castling, en-pessant, and pawn promotion)
     def makeMove(self,move):
+        # save what the move can't give back in the next undo frame
+        stack = self.undo_stack
+        top = self.undo_top
+        if top == len(stack):
+            stack.extend([None] * len(stack))
+        stack[top] = self.castling_rights
+        stack[top+1] = self.enpassant
+        stack[top+2] = move.piece_captured
+        stack[top+3] = self.halfmove_clock
+        stack[top+4] = self.mg_score
+        stack[top+5] = self.eg_score
+        stack[top+6] = self.phase
+        self.undo_top = top + UNDO_FRAME
+        key = self.zobrist_key ^ ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_PIECES[move.piece_moved][move.start_row * 8 + move.start_col]
+        if move.enpassant_move:
+            key ^= ZOBRIST_PIECES[move.piece_captured][move.start_row * 8 + move.end_col]
+        elif move.piece_captured != "--":
+            key ^= ZOBRIST_PIECES[move.piece_captured][move.end_row * 8 + move.end_col]
+        key ^= self.enpassantKey()
         self.board[move.start_row][move.start_col] = "--"
         self.board[move.end_row][move.end_col] = move.piece_moved
         self.move_log.append(move) # log the move
         self.white_to_move = not self.white_to_move # swap player turn
         # update the king's location if moved
         if move.piece_moved == "wK": 
-            self.white_king_location = (move.end_row, move.end_col)
+            self.white_king_location = SQUARES[move.end_row * 8 + move.end_col]
         elif move.piece_moved == "bK":
-            self.black_king_location = (move.end_row, move.end_col)
+            self.black_king_location = SQUARES[move.end_row * 8 + move.end_col]
         # pawn promotion
         if move.pawn_promotion:
-            self.board[move.end_row][move.end_col] = move.piece_moved[0] + 'Q'
+            self.board[move.end_row][move.end_col] = move.piece_moved[0] + move.promotion_piece
         # enpassant move
         if move.enpassant_move:
             self.board[move.start_row][move.end_col] = "--" # capturing the pawn
         # update enpassant variable
         if move.piece_moved[1] == "P" and abs(move.start_row - move.end_row) == 2:
-            self.enpassant = ((move.start_row + move.end_row)//2,move.start_col)
+            self.enpassant = SQUARES[(move.start_row + move.end_row) // 2 * 8 + move.start_col]
         else:
             self.enpassant = ()  
+        key ^= self.enpassantKey()
+        key ^= ZOBRIST_PIECES[self.board[move.end_row][move.end_col]][move.end_row * 8 + move.end_col]
         # castle move
         if move.castle_move:
+            rook = move.piece_moved[0] + "R"
             if move.end_col - move.start_col == 2: # king side castle
                 self.board[move.end_row][move.end_col-1] = self.board[move.end_row][move.end_col+1] 
                 self.board[move.end_row][move.end_col+1] = "--"
+                key ^= ZOBRIST_PIECES[rook][move.end_row * 8 + move.end_col - 1] ^ ZOBRIST_PIECES[rook][move.end_row * 8 + move.end_col + 1]
             else: # queen side castle
                 self.board[move.end_row][move.end_col+1] = self.board[move.end_row][move.end_col-2]
                 self.board[move.end_row][move.end_col-2] = "--"
+                key ^= ZOBRIST_PIECES[rook][move.end_row * 8 + move.end_col + 1] ^ ZOBRIST_PIECES[rook][move.end_row * 8 + move.end_col - 2]
+        self.zobrist_key = key
         # update castling (whenever rook or king moves) 
         self.updateCastling(move)
-        self.castleRightsLog.append(CastleRights(self.current_castling.wks,self.current_castling.bks,
-                                             self.current_castling.wqs,self.current_castling.bqs)) 
+        self.updateEvaluation(move,1)
+        self.pushDrawTracking(move)
+        if self.debug_hash:
+            self.checkZobrist()
+        if self.debug_eval:
+            self.checkEvaluation()
         
            
     # Undo the last move made by a player
     def undoMove(self):
         if len(self.move_log) != 0: # make sure there is a move to undo
             move = self.move_log.pop()
+            self.popDrawTracking(move)
+            self.undo_top -= UNDO_FRAME
+            stack = self.undo_stack
+            top = self.undo_top
+            captured = stack[top+2]
             self.board[move.start_row][move.start_col] = move.piece_moved
-            self.board[move.end_row][move.end_col] = move.piece_captured  
+            self.board[move.end_row][move.end_col] = captured
             self.white_to_move = not self.white_to_move
             # update the king's location if needed
             if move.piece_moved == "wK": 
-                self.white_king_location = (move.start_row, move.start_col)
+                self.white_king_location = SQUARES[move.start_row * 8 + move.start_col]
             elif move.piece_moved == "bK":
-                self.black_king_location = (move.start_row, move.start_col)
+                self.black_king_location = SQUARES[move.start_row * 8 + move.start_col]
             # undo en passant
             if move.enpassant_move:
                 self.board[move.end_row][move.end_col] = "--" # landing square is blank
-                self.board[move.start_row][move.end_col] = move.piece_captured
-                self.enpassant = (move.end_row,move.end_col)
-            # undo a 2 square pawn advance
-            if move.piece_moved[1] == "P" and abs(move.start_row - move.end_row) == 2:
-                self.enpassant = () 
-            # undo castling rights
-            self.castleRightsLog.pop()
-            new_castling = self.castleRightsLog[-1]
-            self.current_castling = CastleRights(new_castling.wks,new_castling.bks,new_castling.wqs,new_castling.bqs)
+                self.board[move.start_row][move.end_col] = captured
             # undo castle move
             if move.castle_move:
                 if move.end_col - move.start_col == 2: # king side castle
@@ -95,31 +343,84 @@ class Logic():
                 else: # queen side castle
                     self.board[move.end_row][move.end_col-2] = self.board[move.end_row][move.end_col+1]
                     self.board[move.end_row][move.end_col+1] = "--"
+            # restore the rest of the state from the undo frame
+            self.castling_rights = stack[top]
+            self.enpassant = stack[top+1]
+            self.halfmove_clock = stack[top+3]
+            self.zobrist_key = self.hash_history[-1] # popDrawTracking left the previous position's key on top
+            self.mg_score = stack[top+4]
+            self.eg_score = stack[top+5]
+            self.phase = stack[top+6]
+            if self.debug_hash:
+                self.checkZobrist()
+            if self.debug_eval:
+                self.checkEvaluation()
+
+    # Apply the evaluation change of a move (sign 1 when making it, -1 when taking it back)
+    def updateEvaluation(self,move,sign):
+        start = move.start_row * 8 + move.start_col
+        end = move.end_row * 8 + move.end_col
+        moved = move.piece_moved
+        placed = moved[0] + move.promotion_piece if move.pawn_promotion else moved
+        mg = MG_VALUES[placed][end] - MG_VALUES[moved][start]
+        eg = EG_VALUES[placed][end] - EG_VALUES[moved][start]
+        phase = PIECE_PHASE[placed] - PIECE_PHASE[moved]
+        captured = move.piece_captured
+        if captured != "--":
+            captured_sq = move.start_row * 8 + move.end_col if move.enpassant_move else end
+            mg -= MG_VALUES[captured][captured_sq]
+            eg -= EG_VALUES[captured][captured_sq]
+            phase -= PIECE_PHASE[captured]
+        if move.castle_move: # the rook hops over the king
+            rook = moved[0] + "R"
+            if move.end_col - move.start_col == 2: # king side castle
+                rook_from, rook_to = end + 1, end - 1
+            else: # queen side castle
+                rook_from, rook_to = end - 2, end + 1
+            mg += MG_VALUES[rook][rook_to] - MG_VALUES[rook][rook_from]
+            eg += EG_VALUES[rook][rook_to] - EG_VALUES[rook][rook_from]
+        self.mg_score += sign * mg
+        self.eg_score += sign * eg
+        self.phase += sign * phase
+
+    # Static evaluation in centipawns for the side to move, tapered between middlegame and endgame
+    def evaluate(self):
+        score = taper(self.mg_score,self.eg_score,self.phase)
+        return score if self.white_to_move else -score
+
+    # Debug mode check that the incremental evaluation matches the board
+    def checkEvaluation(self):
+        if (self.mg_score,self.eg_score,self.phase) != evaluateBoard(self.board):
+            raise RuntimeError("evaluation out of sync after " +
+                               " ".join(move.getUCI() for move in self.move_log))
                 
-    # Update the castling rights in the game
+    # Update the castling rights in the game (a king or rook leaving its square, or a rook captured on its corner)
     def updateCastling(self,move):
-        if move.piece_moved == "wK": # white king is moved
-            self.current_castling.wks = False
-            self.current_castling.wqs = False
-        elif move.piece_moved == "bK": # black king is moved
-            self.current_castling.bks = False
-            self.current_castling.bqs = False
-        elif move.piece_moved == "wR": # white rook is moved
-            if move.start_row == 7 and move.start_col == 0: # rook on the left side
-                self.current_castling.wqs = False
-            elif move.start_row == 7 and move.start_col == 7: # rook on the right side
-                self.current_castling.wks = False
-        elif move.piece_moved == "bR": # black rook is moved
-            if move.start_row == 0 and move.start_col == 7: # rook on the left side
-                self.current_castling.bqs = False
-            elif move.start_row == 0 and move.start_col == 0: # rook on the right side
-                self.current_castling.bks = False
+        rights = self.castling_rights & CASTLING_MASK[move.start_row * 8 + move.start_col] \
+                 & CASTLING_MASK[move.end_row * 8 + move.end_col]
+        if rights != self.castling_rights:
+            self.zobrist_key ^= ZOBRIST_CASTLING_BITS[self.castling_rights] ^ ZOBRIST_CASTLING_BITS[rights]
+            self.castling_rights = rights
             
     # Obtain all of the legal moves considering checks        
     def validMoves(self):
-        temp_enpassant = self.enpassant # copy enpassant 
-        temp_castling = CastleRights(self.current_castling.wks,self.current_castling.bks,
-                                             self.current_castling.wqs,self.current_castling.bqs) # copy castling
+        possible_moves = self.generateMoves()
+        if len(possible_moves) == 0: # either checkmate or stalemate
+            self.check_mate = self.inCheck()
+            self.stale_mate = not self.check_mate
+        else: # position may have been reached again through undo
+            self.check_mate = False
+            self.stale_mate = False
+        return possible_moves
+
+    # Legal moves without setting check_mate/stale_mate (for searches and lookups that must not end the game)
+    def generateMoves(self):
+        if self.pin_aware:
+            return self.legalMoves()
+        return self.filteredMoves()
+
+    # Legal moves by making every possible move and dropping those that leave the king in check
+    def filteredMoves(self):
         possible_moves = self.possibleMoves()
         if self.white_to_move:
             self.getCastleMoves(self.white_king_location[0],self.white_king_location[1],possible_moves)
@@ -132,15 +433,125 @@ class Logic():
                 possible_moves.remove(possible_moves[i])
             self.white_to_move = not self.white_to_move
             self.undoMove()
-        if len(possible_moves) == 0: # either checkmate or stalemate
-            if self.inCheck():
-                self.check_mate = True
-            else:
-                self.stale_mate = True 
-                
-        self.enpassant = temp_enpassant # resetting enpassant
-        self.current_castling = temp_castling # resetting current castling
-        return possible_moves # for now is returning possible moves
+        return possible_moves
+
+    # Legal moves from the checks and pins of the position, without making any move
+    # captures_only keeps captures and promotions and skips castling, for the quiescence search
+    def legalMoves(self,captures_only=False):
+        if self.white_to_move:
+            kr,kc = self.white_king_location
+            ally = "w"
+        else:
+            kr,kc = self.black_king_location
+            ally = "b"
+        checks, pins = self.checksAndPins(kr,kc)
+        legal_moves = []
+        if len(checks) < 2: # only the king can answer a double check
+            block_squares = None
+            if len(checks) == 1: # capture the checker or step in between
+                check_row, check_col, dr, dc = checks[0]
+                if dr == 0 and dc == 0: # knight or pawn checks can't be blocked
+                    block_squares = {(check_row,check_col)}
+                else:
+                    block_squares = set()
+                    for i in range(1,8):
+                        square = (kr + dr * i, kc + dc * i)
+                        block_squares.add(square)
+                        if square == (check_row,check_col):
+                            break
+            piece_moves = []
+            for r in range(8):
+                for c in range(8):
+                    piece = self.board[r][c]
+                    if piece[0] != ally or piece[1] == "K":
+                        continue
+                    del piece_moves[:]
+                    self.move_functions[piece[1]](self,r,c,piece_moves)
+                    pin = pins.get((r,c))
+                    for move in piece_moves:
+                        if captures_only and move.piece_captured == "--" and not move.pawn_promotion:
+                            continue
+                        if move.enpassant_move: # may uncover a check along the rank, test it directly
+                            if self.enpassantIsLegal(move,kr,kc):
+                                legal_moves.append(move)
+                            continue
+                        if pin is not None and (move.end_row - r) * pin[1] != (move.end_col - c) * pin[0]:
+                            continue # a pinned piece can only move along the pin ray
+                        if block_squares is not None and (move.end_row,move.end_col) not in block_squares:
+                            continue
+                        legal_moves.append(move)
+        self.getLegalKingMoves(kr,kc,legal_moves,captures_only)
+        if len(checks) == 0 and not captures_only:
+            self.getCastleMoves(kr,kc,legal_moves)
+        return legal_moves
+
+    # Find the enemy pieces checking the king at (r,c) and the allied pieces pinned to it
+    # checks holds (row, col, dr, dc) with the ray direction from the king, (0, 0) for knights and pawns
+    # pins maps (row, col) of a pinned piece to its pin direction
+    def checksAndPins(self,r,c):
+        board = self.board
+        ally = "w" if self.white_to_move else "b"
+        enemy = "b" if self.white_to_move else "w"
+        pawn_dir = -1 if ally == "w" else 1 # row direction from the king to an attacking enemy pawn
+        checks = []
+        pins = {}
+        for j, d in enumerate(self.king_directions):
+            possible_pin = None
+            for i in range(1,8):
+                end_row = r + d[0] * i
+                end_col = c + d[1] * i
+                if not (0 <= end_row < 8 and 0 <= end_col < 8):
+                    break
+                end_piece = board[end_row][end_col]
+                if end_piece == "--":
+                    continue
+                if end_piece[0] == ally:
+                    if possible_pin is None:
+                        possible_pin = (end_row,end_col)
+                        continue
+                    break # two allied pieces, no pin possible
+                kind = end_piece[1]
+                if (j < 4 and kind in "RQ") or (j >= 4 and kind in "BQ"):
+                    if possible_pin is None:
+                        checks.append((end_row,end_col,d[0],d[1]))
+                    else:
+                        pins[possible_pin] = d
+                elif i == 1 and kind == "P" and j >= 4 and d[0] == pawn_dir and possible_pin is None:
+                    checks.append((end_row,end_col,0,0))
+                break
+        for d in self.knight_directions:
+            end_row = r + d[0]
+            end_col = c + d[1]
+            if 0 <= end_row < 8 and 0 <= end_col < 8 and board[end_row][end_col] == enemy + "N":
+                checks.append((end_row,end_col,0,0))
+        return checks, pins
+
+    # King moves to squares the enemy does not attack (the king is lifted so it can't hide behind itself)
+    def getLegalKingMoves(self,r,c,possible_moves,captures_only=False):
+        board = self.board
+        king = board[r][c]
+        board[r][c] = "--"
+        enemy = "b" if king[0] == "w" else "w"
+        for d in self.king_directions:
+            end_row = r + d[0]
+            end_col = c + d[1]
+            if 0 <= end_row < 8 and 0 <= end_col < 8 and board[end_row][end_col][0] != king[0] \
+                    and (not captures_only or board[end_row][end_col][0] == enemy):
+                if not self.squareUnderAttack(end_row,end_col):
+                    possible_moves.append(Move.fromSquares(r,c,end_row,end_col,king,board[end_row][end_col]))
+        board[r][c] = king
+
+    # En passant removes two pawns from one rank, so test the resulting position directly
+    def enpassantIsLegal(self,move,kr,kc):
+        board = self.board
+        board[move.start_row][move.start_col] = "--"
+        board[move.start_row][move.end_col] = "--"
+        board[move.end_row][move.end_col] = move.piece_moved
+        legal = not self.squareUnderAttack(kr,kc)
+        board[move.start_row][move.start_col] = move.piece_moved
+        board[move.start_row][move.end_col] = move.piece_captured
+        board[move.end_row][move.end_col] = "--"
+        return legal
     
     # Determines if the current player is in check
     def inCheck(self):
@@ -150,15 +561,79 @@ class Logic():
             return self.squareUnderAttack(self.black_king_location[0],self.black_king_location[1])
         
     # Determines if the enemy can attack a specific square (r,c)
+    # Looks outward from the square and stops at the first attacker found
     def squareUnderAttack(self,r,c):
-        self.white_to_move = not self.white_to_move
-        # Generate all of the possible moves for the opponent
-        possible_opp_moves = self.possibleMoves() # switch turn back
-        self.white_to_move = not self.white_to_move
-        for move in possible_opp_moves:
-            if move.end_row == r and move.end_col == c: # square is under attack
+        board = self.board
+        enemy = "b" if self.white_to_move else "w"
+        # pawns attack diagonally towards the side they move to
+        pawn_row = r - 1 if enemy == "b" else r + 1
+        if 0 <= pawn_row < 8:
+            if c-1 >= 0 and board[pawn_row][c-1] == enemy + "P":
+                return True
+            if c+1 <= 7 and board[pawn_row][c+1] == enemy + "P":
                 return True
+        for d in self.knight_directions:
+            end_row = r + d[0]
+            end_col = c + d[1]
+            if 0 <= end_row < 8 and 0 <= end_col < 8 and board[end_row][end_col] == enemy + "N":
+                return True
+        for d in self.king_directions:
+            end_row = r + d[0]
+            end_col = c + d[1]
+            if 0 <= end_row < 8 and 0 <= end_col < 8 and board[end_row][end_col] == enemy + "K":
+                return True
+        # sliding pieces, the first piece met along each ray decides
+        for directions, sliders in ((self.rook_directions,"RQ"),(self.bishop_directions,"BQ")):
+            for d in directions:
+                end_row = r + d[0]
+                end_col = c + d[1]
+                while 0 <= end_row < 8 and 0 <= end_col < 8:
+                    end_piece = board[end_row][end_col]
+                    if end_piece != "--":
+                        if end_piece[0] == enemy and end_piece[1] in sliders:
+                            return True
+                        break
+                    end_row += d[0]
+                    end_col += d[1]
         return False
+
+    # Map of every square the enemy attacks (attacked[r][c] is True when under attack)
+    def attackedSquares(self):
+        board = self.board
+        enemy = "b" if self.white_to_move else "w"
+        attacked = [[False] * 8 for _ in range(8)]
+        for r in range(8):
+            for c in range(8):
+                piece = board[r][c]
+                if piece[0] != enemy:
+                    continue
+                kind = piece[1]
+                if kind == "P":
+                    end_row = r + 1 if enemy == "b" else r - 1
+                    if 0 <= end_row < 8:
+                        if c-1 >= 0:
+                            attacked[end_row][c-1] = True
+                        if c+1 <= 7:
+                            attacked[end_row][c+1] = True
+                elif kind == "N" or kind == "K":
+                    for d in (self.knight_directions if kind == "N" else self.king_directions):
+                        end_row = r + d[0]
+                        end_col = c + d[1]
+                        if 0 <= end_row < 8 and 0 <= end_col < 8:
+                            attacked[end_row][end_col] = True
+                else:
+                    directions = self.rook_directions if kind == "R" else \
+                                 self.bishop_directions if kind == "B" else self.king_directions
+                    for d in directions:
+                        end_row = r + d[0]
+                        end_col = c + d[1]
+                        while 0 <= end_row < 8 and 0 <= end_col < 8:
+                            attacked[end_row][end_col] = True
+                            if board[end_row][end_col] != "--":
+                                break
+                            end_row += d[0]
+                            end_col += d[1]
+        return attacked
     
     # Obtain all of the legal moves whithout considering checks
     def possibleMoves(self):
@@ -168,141 +643,139 @@ class Logic():
                 turn = self.board[r][c][0]
                 if (turn == "w" and self.white_to_move) or (turn == "b" and not self.white_to_move):
                     piece = self.board[r][c][1]
-                    self.move_functions[piece](r,c,possible_moves) # calls the appropriate move function
+                    self.move_functions[piece](self,r,c,possible_moves) # calls the appropriate move function
         return possible_moves
     
     # Get all pawn moves                    
     def getPawnMoves(self,r,c,possible_moves):
+        board = self.board
         if self.white_to_move: # white pawn moves
-            if self.board[r-1][c] == "--": # one square move
-                possible_moves.append(Move((r,c),(r-1,c),self.board))
-                if r == 6 and self.board[r-2][c] == "--": # two square move
-                    possible_moves.append(Move((r,c),(r-2,c),self.board))
+            if board[r-1][c] == "--": # one square move
+                self.addPawnMoves(r,c,r-1,c,possible_moves)
+                if r == 6 and board[r-2][c] == "--": # two square move
+                    possible_moves.append(Move.fromSquares(r,c,r-2,c,"wP","--"))
             if c-1 >= 0: 
-                if self.board[r-1][c-1][0] == "b": # capture enemy piece to the left: 
-                    possible_moves.append(Move((r,c),(r-1,c-1),self.board))
+                if board[r-1][c-1][0] == "b": # capture enemy piece to the left: 
+                    self.addPawnMoves(r,c,r-1,c-1,possible_moves)
                 elif (r-1,c-1) == self.enpassant: # enpassant capture to the left
-                    possible_moves.append(Move((r,c),(r-1,c-1),self.board,enpassant_move=True))
+                    possible_moves.append(Move.fromSquares(r,c,r-1,c-1,"wP","bP",enpassant_move=True))
             if c+1 <= 7: 
-                if self.board[r-1][c+1][0] == "b": # capture enemy piece to the right
-                    possible_moves.append(Move((r,c),(r-1,c+1),self.board))
+                if board[r-1][c+1][0] == "b": # capture enemy piece to the right
+                    self.addPawnMoves(r,c,r-1,c+1,possible_moves)
                 elif (r-1,c+1) == self.enpassant: # enpassant capture to the right
-                    possible_moves.append(Move((r,c),(r-1,c+1),self.board,enpassant_move=True))
+                    possible_moves.append(Move.fromSquares(r,c,r-1,c+1,"wP","bP",enpassant_move=True))
         else: # black pawn moves
-            if self.board[r+1][c] == "--":
-                possible_moves.append(Move((r,c),(r+1,c),self.board))
-                if r == 1 and self.board[r+2][c] == "--": # two square move
-                    possible_moves.append(Move((r,c),(r+2,c),self.board))
+            if board[r+1][c] == "--":
+                self.addPawnMoves(r,c,r+1,c,possible_moves)
+                if r == 1 and board[r+2][c] == "--": # two square move
+                    possible_moves.append(Move.fromSquares(r,c,r+2,c,"bP","--"))
             if c-1 >= 0: 
-                if self.board[r+1][c-1][0] == "w": # capture enemy piece to the right
-                    possible_moves.append(Move((r,c),(r+1,c-1),self.board))
+                if board[r+1][c-1][0] == "w": # capture enemy piece to the right
+                    self.addPawnMoves(r,c,r+1,c-1,possible_moves)
                 elif (r+1,c-1) == self.enpassant: # enpassant capture to the right
-                    possible_moves.append(Move((r,c),(r+1,c-1),self.board,enpassant_move=True))
+                    possible_moves.append(Move.fromSquares(r,c,r+1,c-1,"bP","wP",enpassant_move=True))
             if c+1 <= 7: 
-                if self.board[r+1][c+1][0] == "w": # capture enemy piece to the left
-                    possible_moves.append(Move((r,c),(r+1,c+1),self.board))
+                if board[r+1][c+1][0] == "w": # capture enemy piece to the left
+                    self.addPawnMoves(r,c,r+1,c+1,possible_moves)
                 elif (r+1,c+1) == self.enpassant: # enpassant capture to the left
-                    possible_moves.append(Move((r,c),(r+1,c+1),self.board,enpassant_move=True))
+                    possible_moves.append(Move.fromSquares(r,c,r+1,c+1,"bP","wP",enpassant_move=True))
+
+    # Add a pawn move, expanding it into every promotion piece on the last rank
+    def addPawnMoves(self,r,c,end_row,end_col,possible_moves):
+        piece = self.board[r][c]
+        end_piece = self.board[end_row][end_col]
+        if end_row == 0 or end_row == 7:
+            for promotion_piece in Move.promotion_pieces: # queen first so the GUI picks it on a click
+                possible_moves.append(Move.fromSquares(r,c,end_row,end_col,piece,end_piece,promotion_piece=promotion_piece))
+        else:
+            possible_moves.append(Move.fromSquares(r,c,end_row,end_col,piece,end_piece))
 
     # Get all rook moves
     def getRookMoves(self,r,c,possible_moves):
-        directions = ((-1,0),(0,-1),(1,0),(0,1)) # directions the piece can move
-        enemycolor = "b" if self.white_to_move else "w" # check the enemy pieces
-        for d in directions:
-            for i in range(1,8):
-                end_row = r + d[0] * i
-                end_col = c + d[1] * i
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece == "--": # empty space on board  
-                        possible_moves.append(Move((r,c),(end_row,end_col),self.board))
-                    elif end_piece[0] == enemycolor: # enemy piece 
-                        possible_moves.append(Move((r,c),(end_row,end_col),self.board)) 
-                        break;
-                    else: # friendly piece 
-                        break;
-                else: # out of the board
-                    break;                
+        self.getSlidingMoves(r,c,self.rook_directions,possible_moves)
     
     # Get all Knight moves
     def getKnightMoves(self,r,c,possible_moves):
-        directions = ((1,2),(2,1),(2,-1),(1,-2),(-1,-2),(-2,-1),(-2,1),(-1,2))
+        board = self.board
+        piece = board[r][c]
         enemycolor = "b" if self.white_to_move else "w"
-        for d in directions:
+        for d in self.knight_directions:
             end_row = r + d[0] 
             end_col = c + d[1] 
             if 0 <= end_row < 8 and 0 <= end_col < 8:
-                end_piece = self.board[end_row][end_col]
+                end_piece = board[end_row][end_col]
                 if end_piece == "--" or end_piece[0] == enemycolor:
-                    possible_moves.append(Move((r,c),(end_row,end_col),self.board))
+                    possible_moves.append(Move.fromSquares(r,c,end_row,end_col,piece,end_piece))
 
     # Get all Bishop Moves
     def getBishopMoves(self,r,c,possible_moves):
-        directions = ((-1,1),(1,-1),(1,1),(-1,-1)) # directions the piece can move
+        self.getSlidingMoves(r,c,self.bishop_directions,possible_moves)
+
+    # Moves of a rook, bishop or queen along the given directions
+    def getSlidingMoves(self,r,c,directions,possible_moves):
+        board = self.board
+        piece = board[r][c]
         enemycolor = "b" if self.white_to_move else "w" # check the enemy pieces
         for d in directions:
-            for i in range(1,8):
-                end_row = r + d[0] * i
-                end_col = c + d[1] * i
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece == "--": # empty space on board  
-                        possible_moves.append(Move((r,c),(end_row,end_col),self.board))
-                    elif end_piece[0] == enemycolor: # enemy piece 
-                        possible_moves.append(Move((r,c),(end_row,end_col),self.board)) 
-                        break;
-                    else: # friendly piece 
-                        break;
-                else: # out of the board
-                    break;            
+            end_row = r + d[0]
+            end_col = c + d[1]
+            while 0 <= end_row < 8 and 0 <= end_col < 8:
+                end_piece = board[end_row][end_col]
+                if end_piece == "--": # empty space on board  
+                    possible_moves.append(Move.fromSquares(r,c,end_row,end_col,piece,"--"))
+                elif end_piece[0] == enemycolor: # enemy piece 
+                    possible_moves.append(Move.fromSquares(r,c,end_row,end_col,piece,end_piece)) 
+                    break
+                else: # friendly piece 
+                    break
+                end_row += d[0]
+                end_col += d[1]
     
     # Get all Queen Moves
     def getQueenMoves(self,r,c,possible_moves):
-        self.getRookMoves(r,c,possible_moves)
-        self.getBishopMoves(r,c,possible_moves)
+        self.getSlidingMoves(r,c,self.king_directions,possible_moves)
     
     # Get all King Moves (without checks)
     def getKingMoves(self,r,c,possible_moves):
-        directions = ((-1,0),(0,-1),(1,0),(0,1),(-1,1),(1,-1),(1,1),(-1,-1))
+        piece = self.board[r][c]
         enemycolor = "b" if self.white_to_move else "w" # check the enemy pieces
-        for d in directions:
+        for d in self.king_directions:
             end_row = r + d[0] 
             end_col = c + d[1]
             if 0 <= end_row < 8 and 0 <= end_col < 8:
                 end_piece = self.board[end_row][end_col]
                 if end_piece == "--" or end_piece[0] == enemycolor: # empty space on board  
-                    possible_moves.append(Move((r,c),(end_row,end_col),self.board))   
+                    possible_moves.append(Move.fromSquares(r,c,end_row,end_col,piece,end_piece))   
     
     # Generate all valid castle moves
     def getCastleMoves(self,r,c,possible_moves):
-        if self.squareUnderAttack(r,c):
+        kingside, queenside = (WKS, WQS) if self.white_to_move else (BKS, BQS)
+        if not self.castling_rights & (kingside | queenside):
+            return # no castling rights left
+        attacked = self.attackedSquares() # one map shared by all castling checks
+        if attacked[r][c]:
             return # can't castle 
-        if (self.white_to_move and self.current_castling.wks) or (not self.white_to_move and self.current_castling.bks):
-            self.getKingsideCastleMoves(r,c,possible_moves)
-        if (self.white_to_move and self.current_castling.wqs) or (not self.white_to_move and self.current_castling.bqs):
-            self.getQueensideCastleMoves(r,c,possible_moves)
+        if self.castling_rights & kingside:
+            self.getKingsideCastleMoves(r,c,possible_moves,attacked)
+        if self.castling_rights & queenside:
+            self.getQueensideCastleMoves(r,c,possible_moves,attacked)
     
     # King side castle moves
-    def getKingsideCastleMoves(self,r,c,possible_moves):
+    def getKingsideCastleMoves(self,r,c,possible_moves,attacked):
         if self.board[r][c+1] == "--" and self.board[r][c+2] == "--":
-            if not self.squareUnderAttack(r,c+1) and not self.squareUnderAttack(r,c+2):
-                possible_moves.append(Move((r,c),(r,c+2),self.board, castle_move = True))
+            if not attacked[r][c+1] and not attacked[r][c+2]:
+                possible_moves.append(Move.fromSquares(r,c,r,c+2,self.board[r][c],"--",castle_move=True))
     
     # Queen side castle moves    
-    def getQueensideCastleMoves(self,r,c,possible_moves):
-        if self.board[r][c-1] == "--" and self.board[r][c-2] == "--" and self.board[r][c-3]:
-             if not self.squareUnderAttack(r,c-1) and not self.squareUnderAttack(r,c-2):
-                possible_moves.append(Move((r,c),(r,c-2),self.board, castle_move = True))
-            
-
-class CastleRights():
-    
-    def __init__(self,wks,bks,wqs,bqs):
-        self.wks = wks
-        self.bks = bks
-        self.wqs = wqs
-        self.bqs = bqs
+    def getQueensideCastleMoves(self,r,c,possible_moves,attacked):
+        if self.board[r][c-1] == "--" and self.board[r][c-2] == "--" and self.board[r][c-3] == "--":
+             if not attacked[r][c-1] and not attacked[r][c-2]:
+                possible_moves.append(Move.fromSquares(r,c,r,c-2,self.board[r][c],"--",castle_move=True))
 
+    # Move generator per piece letter, shared by every game (called as move_functions[piece](self,r,c,moves))
+    move_functions = {"P":getPawnMoves,"R":getRookMoves,"N":getKnightMoves,
+                      "B":getBishopMoves,"Q":getQueenMoves,"K":getKingMoves}
+            
 
 class Move():
     ranks_to_rows = {"1": 7, "2": 6, "3": 5, "4": 4,
@@ -313,7 +786,14 @@ class Move():
                      "e": 4, "f": 5, "g": 6, "h": 7}
     cols_to_files = {v: k for k, v in files_to_cols.items()}
 
-    def __init__(self, start_sq, end_sq, board,enpassant_move = False, castle_move = False):
+    promotion_pieces = ("Q", "R", "B", "N")
+
+    # Fixed attributes, no per-instance dict
+    __slots__ = ("start_row", "start_col", "end_row", "end_col", "piece_moved", "piece_captured",
+                 "pawn_promotion", "promotion_piece", "enpassant_move", "castle_move", "moveID")
+
+    # Build a move from two clicked squares, reading the pieces from the board
+    def __init__(self, start_sq, end_sq, board,enpassant_move = False, castle_move = False, promotion_piece = "Q"):
         # Pieces first click
         self.start_row = start_sq[0]
         self.start_col = start_sq[1]
@@ -325,27 +805,61 @@ class Move():
         self.piece_captured = board[self.end_row][self.end_col]
         # Pawn promotion
         self.pawn_promotion = (self.piece_moved == "wP" and self.end_row == 0) or (self.piece_moved == "bP" and self.end_row == 7)
+        self.promotion_piece = promotion_piece
         # En passant 
         self.enpassant_move = enpassant_move
         if self.enpassant_move:
-            self.piece_captured = "wp" if self.piece_moved == "bP" else "bP"
+            self.piece_captured = "wP" if self.piece_moved == "bP" else "bP"
         # Castle move
         self.castle_move = castle_move
-        # ID 
-        self.moveID = self.start_row * 1000 + self.start_col * 100 \
-                    + self.end_row * 10 + self.end_col
-        # print(self.moveID)
-    
+        # ID: from square, to square and promotion piece packed into one int
+        self.moveID = self.start_row * 8 + self.start_col | (self.end_row * 8 + self.end_col) << 6
+        if self.pawn_promotion: # under-promotions get their own ID (queen keeps the plain one)
+            self.moveID |= self.promotion_pieces.index(promotion_piece) << 12
+
+    # Build a move from coordinates and pieces the generator already knows (no tuples, no board reads)
+    @classmethod
+    def fromSquares(cls, start_row, start_col, end_row, end_col, piece_moved, piece_captured,
+                    enpassant_move=False, castle_move=False, promotion_piece="Q"):
+        move = cls.__new__(cls)
+        move.start_row = start_row
+        move.start_col = start_col
+        move.end_row = end_row
+        move.end_col = end_col
+        move.piece_moved = piece_moved
+        move.piece_captured = piece_captured
+        move.pawn_promotion = piece_moved[1] == "P" and (end_row == 0 or end_row == 7)
+        move.promotion_piece = promotion_piece
+        move.enpassant_move = enpassant_move
+        move.castle_move = castle_move
+        move.moveID = start_row * 8 + start_col | (end_row * 8 + end_col) << 6
+        if move.pawn_promotion and promotion_piece != "Q":
+            move.moveID |= cls.promotion_pieces.index(promotion_piece) << 12
+        return move
+
     # Overriding the equals method
     def __eq__(self, other):
         if isinstance(other,Move):
             return self.moveID == other.moveID
         return False
+
+    # Equal moves hash the same, so moves can be dict and set keys
+    def __hash__(self):
+        return self.moveID
     
     # Introduced Proper Chess Notation (ex. Nf3)
     def getChessNotation(self):
-        return self.piece_moved[1] + \
-               self.getRankedFile(self.end_row, self.end_col)
+        notation = self.piece_moved[1] + self.getRankedFile(self.end_row, self.end_col)
+        if self.pawn_promotion:
+            notation += "=" + self.promotion_piece
+        return notation
+
+    # Coordinate notation used by UCI and perft divide (ex. e2e4, e7e8q)
+    def getUCI(self):
+        uci = self.getRankedFile(self.start_row, self.start_col) + self.getRankedFile(self.end_row, self.end_col)
+        if self.pawn_promotion:
+            uci += self.promotion_piece.lower()
+        return uci
 
     def getRankedFile(self, row, col):
         return self.cols_to_files[col] + self.rows_to_ranks[row]
@@ -1,38 +1,114 @@
-import pygame as p
+import argparse
+import os
+import time
+from collections import OrderedDict
+from bitboard import BitboardLogic
 from logic import Logic
 from logic import Move
 
-p.init()
+START_TIME = time.perf_counter()  # for the startup time report (pygame is imported later, by initPygame)
+p = None  # pygame, imported by initPygame() so importing this module stays cheap
 WIDTH = HEIGHT = 512  # Resolution of the screen
 DIMENSION = 8  # dimensions of the chess board
 SQ_SIZE = HEIGHT // DIMENSION  # dimension of each square
 MAX_FPS = 15  # for animations later on
 IMAGES = {}
+PIECES = ["wR", "wN", "wB", "wQ", "wK", "bR", "bN", "bB", "bQ", "bK", "wP", "bP"]
+SPRITE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Pieces_Sprite")
+ATLAS_DIR = os.path.join(SPRITE_DIR, ".cache")
+BACKENDS = {"logic": Logic, "bitboard": BitboardLogic}  # interchangeable position engines
+
+
+# Import pygame and start only the subsystems the game uses (no audio, joystick, ...)
+def initPygame():
+    global p
+    import pygame as p
+    p.display.init()
+    p.font.init()
 
 
 # Initialize a global dictionary of images
+# All pieces come from one pre-scaled atlas per SQ_SIZE, rebuilt only when a source image is newer
 def loadImages():
-    pieces = ["wR", "wN", "wB", "wQ", "wK", "bR", "bN", "bB", "bQ", "bK", "wP", "bP"]
-    for piece in pieces:
-        IMAGES[piece] = p.transform.scale(
-            p.image.load("Pieces_Sprite/" + piece + ".png"), (SQ_SIZE, SQ_SIZE)
-        )
+    atlas_path = os.path.join(ATLAS_DIR, "atlas_%d.png" % SQ_SIZE)
+    sources = [os.path.join(SPRITE_DIR, piece + ".png") for piece in PIECES]
+    newest_source = max(os.path.getmtime(source) for source in sources)
+    if os.path.exists(atlas_path) and os.path.getmtime(atlas_path) >= newest_source:
+        atlas = p.image.load(atlas_path)
+    else:
+        atlas = p.Surface((SQ_SIZE * len(PIECES), SQ_SIZE), p.SRCALPHA)
+        for i, source in enumerate(sources):
+            atlas.blit(p.transform.scale(p.image.load(source), (SQ_SIZE, SQ_SIZE)), (i * SQ_SIZE, 0))
+        try:
+            os.makedirs(ATLAS_DIR, exist_ok=True)
+            p.image.save(atlas, atlas_path)
+        except OSError: # read-only install, keep the atlas in memory only
+            pass
+    atlas = atlas.convert_alpha()
+    for i, piece in enumerate(PIECES):
+        IMAGES[piece] = atlas.subsurface(p.Rect(i * SQ_SIZE, 0, SQ_SIZE, SQ_SIZE))
+
+
+# Legal moves per position keyed by zobrist hash, so undo and repeated positions skip generation
+# The least recently used position is dropped once the cache is full
+class MoveCache():
+
+    def __init__(self, size=256):
+        self.size = size
+        self.entries = OrderedDict() # key -> (valid_moves, moves_by_origin, check_mate, stale_mate)
+
+    # Valid moves of the position and an index {(row, col): {(end_row, end_col): move}}
+    def validMoves(self, game_state):
+        key = game_state.zobrist_key
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            game_state.check_mate, game_state.stale_mate = entry[2], entry[3]
+            return entry[0], entry[1]
+        valid_moves = game_state.validMoves()
+        moves_by_origin = {}
+        for move in valid_moves:
+            targets = moves_by_origin.setdefault((move.start_row, move.start_col), {})
+            targets.setdefault((move.end_row, move.end_col), move) # queen promotion comes first
+        self.entries[key] = (valid_moves, moves_by_origin, game_state.check_mate, game_state.stale_mate)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return valid_moves, moves_by_origin
 
 
 """
 The main drive for our code. This will handle user input and updating the graphics
 """
 
-def main():
-    p.init()
+def main(backend="logic", renderer_mode="dirty", fps=MAX_FPS, book_path=None, profile=False, tablebase_path=None):
+    initPygame()
     screen = p.display.set_mode((WIDTH, HEIGHT))
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
-    game_state = Logic()
-    valid_moves = game_state.validMoves()
+    book = None
+    if book_path is not None:
+        from book import OpeningBook
+        book = OpeningBook(book_path)
+    tablebase = None
+    if tablebase_path is not None:
+        from tablebase import Tablebase
+        tablebase = Tablebase(tablebase_path)
+    engine = BACKENDS[backend]
+    profiler = None
+    if profile: # count and time Logic calls, shown in an overlay
+        from profiler import Profiler
+        profiler = Profiler(backend=engine).enable()
+    game_state = engine()
+    move_cache = MoveCache()
+    valid_moves, moves_by_origin = move_cache.validMoves(game_state)
     move_made = False # flag variable for when a move is made
     animate = False # flag variable for animation
     loadImages()
+    renderer = DirtyRenderer(screen) if renderer_mode == "dirty" else None
+    render_time = 0.0 # render time summed since the last report
+    render_frames = 0
+    last_report = time.perf_counter()
+    startup_reported = False
     running = True
     sq_selected = () # no square is selected
     player_clicks = [] # keep tracks of player clicks
@@ -56,13 +132,13 @@ def main():
                     if len(player_clicks) == 2: # two clicks have occured
                         move = Move(player_clicks[0],player_clicks[1],game_state.board)
                         print(move.getChessNotation())
-                        for i in range(len(valid_moves)):    
-                            if move == valid_moves[i]:
-                                game_state.makeMove(valid_moves[i])
-                                move_made = True
-                                sq_selected = () # reset user clicks
-                                animate = True
-                                player_clicks = []
+                        valid_move = moves_by_origin.get(player_clicks[0], {}).get(player_clicks[1])
+                        if valid_move is not None:
+                            game_state.makeMove(valid_move)
+                            move_made = True
+                            sq_selected = () # reset user clicks
+                            animate = True
+                            player_clicks = []
                         if not move_made:    
                             player_clicks = [sq_selected]
             # handles key presses
@@ -71,9 +147,25 @@ def main():
                     game_state.undoMove() # undo move when z is pressed
                     move_made = True
                     animate = False
+                if e.key == p.K_b and book is not None and not game_over: # play a book move when 'b' is pressed
+                    book_move = book.pickMove(game_state)
+                    if book_move is not None:
+                        game_state.makeMove(book_move)
+                        sq_selected = ()
+                        player_clicks = []
+                        move_made = True
+                        animate = True
+                if e.key == p.K_t and tablebase is not None and not game_over: # play the tablebase move when 't' is pressed
+                    best = tablebase.bestMove(game_state)
+                    if best is not None:
+                        game_state.makeMove(best[0])
+                        sq_selected = ()
+                        player_clicks = []
+                        move_made = True
+                        animate = True
                 if e.key == p.K_r: # reset the board when 'r' is pressed
-                    game_state = Logic()  
-                    valid_moves = game_state.validMoves()
+                    game_state = engine()  
+                    valid_moves, moves_by_origin = move_cache.validMoves(game_state)
                     sq_selected = ()
                     player_clicks = []
                     move_made = True
@@ -81,22 +173,49 @@ def main():
                     game_over = False 
         if move_made:
             if animate:
-                animateMove(game_state.move_log[-1],screen,game_state.board,clock)
-            valid_moves = game_state.validMoves()
+                if renderer is not None:
+                    renderer.animateMove(game_state.move_log[-1],game_state.board,clock)
+                else:
+                    animateMove(game_state.move_log[-1],screen,game_state.board,clock)
+            valid_moves, moves_by_origin = move_cache.validMoves(game_state)
             move_made = False
             animate = False
-        drawGameState(screen, game_state,valid_moves,sq_selected)
+        text = None
         if game_state.check_mate:
-            game_over = True
-            if game_state.white_to_move:
-                drawText(screen, "Black wins by checkmate")
-            else:
-                drawText(screen, "White wins by checkmate")
+            text = "Black wins by checkmate" if game_state.white_to_move else "White wins by checkmate"
         elif game_state.stale_mate:
-            game_over = True
-            drawText(screen,"Stalemate")
-        clock.tick(MAX_FPS)
-        p.display.flip()
+            text = "Stalemate"
+        elif game_state.drawReason() is not None:
+            text = "Draw by " + game_state.drawReason()
+        game_over = text is not None
+        overlays = []
+        if profiler is not None:
+            overlays.append(profileOverlay(profiler))
+        if tablebase is not None:
+            overlays.append(tablebaseOverlay(tablebase,game_state))
+        overlay = "  |  ".join(line for line in overlays if line) or None
+        frame_start = time.perf_counter()
+        if renderer is not None:
+            renderer.draw(game_state,moves_by_origin,sq_selected,text,overlay)
+        else:
+            drawGameState(screen, game_state,moves_by_origin,sq_selected)
+            if text is not None:
+                drawText(screen,text)
+            if overlay is not None:
+                drawOverlay(screen,overlay)
+            p.display.flip()
+        if not startup_reported: # first frame is on screen
+            print("startup %.0f ms" % (1000 * (time.perf_counter() - START_TIME)))
+            startup_reported = True
+        render_time += time.perf_counter() - frame_start
+        render_frames += 1
+        if frame_start - last_report >= 1.0: # show the average render time once a second
+            p.display.set_caption("Chess - render %.2f ms/frame, %.0f fps"
+                                  % (1000 * render_time / render_frames, clock.get_fps()))
+            render_time = 0.0
+            render_frames = 0
+            last_report = frame_start
+        clock.tick(fps)
         """
         Ending the game 
         if game_state.check_mate:
@@ -113,7 +232,7 @@ Responsible for all graphics in the current game state
 """
 
 # Highligh square selected
-def highlightSquares(screen,game_state,valid_moves,sq_selected):
+def highlightSquares(screen,game_state,moves_by_origin,sq_selected):
     if sq_selected != ():
         r,c = sq_selected
         if game_state.board[r][c][0] == ("w" if game_state.white_to_move else "b"):
@@ -124,14 +243,13 @@ def highlightSquares(screen,game_state,valid_moves,sq_selected):
             screen.blit(s,(c * SQ_SIZE, r * SQ_SIZE))
             # highlight moves from that square
             s.fill(p.Color("red"))
-            for move in valid_moves:
-                if move.start_row == r and move.start_col == c:
-                    screen.blit(s,(move.end_col * SQ_SIZE , move.end_row * SQ_SIZE ))
+            for end_row, end_col in moves_by_origin.get(sq_selected, {}):
+                screen.blit(s,(end_col * SQ_SIZE , end_row * SQ_SIZE ))
                     
 # Draw the current game state
-def drawGameState(screen, game_state, valid_moves,sq_selected):
+def drawGameState(screen, game_state, moves_by_origin,sq_selected):
     drawBoard(screen)  # draw the squares on the board
-    highlightSquares(screen,game_state,valid_moves,sq_selected)
+    highlightSquares(screen,game_state,moves_by_origin,sq_selected)
     drawPieces(screen, game_state.board)  # draw pieces on top of those squares
     
 # Draw the board
@@ -174,12 +292,166 @@ def animateMove(move,screen,board,clock):
         p.display.flip()
         clock.tick(60)
     
+TEXT_SURFACES = {} # rendered text -> (shadow, text, location)
+FONT = None # fonts are created once, on first use (pygame has to be initialized)
+OVERLAY_FONT = None
+
 def drawText(screen,text):
-    font = p.font.SysFont("Helvitca",32,True,False)
-    text_obj = font.render(text,0,p.Color("Gray"))
-    text_location = p.Rect(0,0,WIDTH,HEIGHT).move(WIDTH/2-text_obj.get_width()/2,HEIGHT/2-text_obj.get_height()/2)
-    screen.blit(text_obj,text_location)
-    text_obj = font.render(text,0,p.Color("Black"))
+    global FONT
+    if text not in TEXT_SURFACES:
+        if FONT is None:
+            FONT = p.font.SysFont("Helvitca",32,True,False)
+        shadow = FONT.render(text,0,p.Color("Gray"))
+        text_location = p.Rect(0,0,WIDTH,HEIGHT).move(WIDTH/2-shadow.get_width()/2,HEIGHT/2-shadow.get_height()/2)
+        TEXT_SURFACES[text] = (shadow,FONT.render(text,0,p.Color("Black")),text_location)
+    shadow, text_obj, text_location = TEXT_SURFACES[text]
+    screen.blit(shadow,text_location)
     screen.blit(text_obj,text_location.move(2,2))
+    return text_location.inflate(4,4)
+
+# Move generation time of the last position and the mean over the game, from the profiler
+def profileOverlay(profiler):
+    root = profiler.lastRoot("validMoves")
+    if root is None:
+        return None
+    roots = [other.seconds for other in profiler.roots if other.name == "validMoves"]
+    return "movegen %.2f ms (mean %.2f)  %d moves  %d attack checks  %d Move" % (
+        1000 * root.seconds, 1000 * sum(roots) / len(roots), root.moves or 0,
+        root.calls.get("attackersOf",0) or root.calls.get("squareUnderAttack",0) + root.calls.get("attackedSquares",0),
+        root.calls.get("Move",0))
+
+# Endgame table result of the position, None when the tables don't cover it
+def tablebaseOverlay(tablebase,game_state):
+    from tablebase import describe
+    probe = tablebase.probe(game_state)
+    if probe is None:
+        return None
+    return "tablebase: %s to move, %s" % ("white" if game_state.white_to_move else "black", describe(*probe))
+
+# Small text on a dark strip in the top left corner
+def drawOverlay(screen,text):
+    global OVERLAY_FONT
+    if OVERLAY_FONT is None:
+        OVERLAY_FONT = p.font.SysFont("Helvitca",18)
+    text_obj = OVERLAY_FONT.render(text,True,p.Color("white"))
+    rect = text_obj.get_rect().inflate(8,4)
+    rect.topleft = (0,0)
+    background = p.Surface(rect.size)
+    background.set_alpha(180)
+    background.fill(p.Color("black"))
+    screen.blit(background,rect)
+    screen.blit(text_obj,rect.move(4,2))
+    return rect
+
+
+# Renders only the squares that changed since the last frame, from a pre-rendered board surface
+class DirtyRenderer():
+
+    def __init__(self, screen):
+        self.screen = screen
+        self.board_surface = p.Surface((WIDTH, HEIGHT)).convert()
+        drawBoard(self.board_surface)
+        self.selected_surface = p.Surface((SQ_SIZE,SQ_SIZE))
+        self.selected_surface.set_alpha(250)
+        self.selected_surface.fill(p.Color("green"))
+        self.target_surface = p.Surface((SQ_SIZE,SQ_SIZE))
+        self.target_surface.set_alpha(250)
+        self.target_surface.fill(p.Color("red"))
+        self.drawn_board = None # board as it is on screen
+        self.drawn_highlights = {}
+        self.drawn_text = None
+        self.text_rect = None
+        self.drawn_overlay = None
+        self.overlay_rect = None
+
+    def squareRect(self, r, c):
+        return p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+
+    # Squares to highlight, {(row, col): surface}
+    def highlights(self, game_state, moves_by_origin, sq_selected):
+        if sq_selected == ():
+            return {}
+        r,c = sq_selected
+        if game_state.board[r][c][0] != ("w" if game_state.white_to_move else "b"):
+            return {}
+        squares = {square: self.target_surface for square in moves_by_origin.get(sq_selected, {})}
+        squares[sq_selected] = self.selected_surface
+        return squares
+
+    def drawSquare(self, board, r, c, highlights):
+        rect = self.squareRect(r, c)
+        self.screen.blit(self.board_surface, rect, rect)
+        if (r,c) in highlights:
+            self.screen.blit(highlights[(r,c)], rect)
+        if board[r][c] != "--":
+            self.screen.blit(IMAGES[board[r][c]], rect)
+        return rect
+
+    def draw(self, game_state, moves_by_origin, sq_selected, text=None, overlay=None):
+        board = game_state.board
+        highlights = self.highlights(game_state, moves_by_origin, sq_selected)
+        if self.drawn_board is None:
+            dirty = {(r,c) for r in range(DIMENSION) for c in range(DIMENSION)}
+        else:
+            dirty = {(r,c) for r in range(DIMENSION) for c in range(DIMENSION)
+                     if board[r][c] != self.drawn_board[r][c]}
+            dirty.update(square for square in highlights if highlights[square] is not self.drawn_highlights.get(square))
+            dirty.update(square for square in self.drawn_highlights if square not in highlights)
+        if text != self.drawn_text and self.text_rect is not None: # clear the old text
+            dirty.update((r,c) for r in range(DIMENSION) for c in range(DIMENSION)
+                         if self.squareRect(r,c).colliderect(self.text_rect))
+        if overlay != self.drawn_overlay and self.overlay_rect is not None: # clear the old overlay
+            dirty.update((r,c) for r in range(DIMENSION) for c in range(DIMENSION)
+                         if self.squareRect(r,c).colliderect(self.overlay_rect))
+        rects = [self.drawSquare(board, r, c, highlights) for r, c in dirty]
+        if text is not None and (text != self.drawn_text or any(rect.colliderect(self.text_rect) for rect in rects)):
+            self.text_rect = drawText(self.screen, text)
+            rects.append(self.text_rect)
+        elif text is None:
+            self.text_rect = None
+        if overlay is not None and (overlay != self.drawn_overlay or
+                                    any(rect.colliderect(self.overlay_rect) for rect in rects)):
+            self.overlay_rect = drawOverlay(self.screen, overlay)
+            rects.append(self.overlay_rect)
+        elif overlay is None:
+            self.overlay_rect = None
+        if rects:
+            p.display.update(rects)
+        self.drawn_board = [row[:] for row in board]
+        self.drawn_highlights = highlights
+        self.drawn_text = text
+        self.drawn_overlay = overlay
+
+    # Animating a move, redrawing only the squares the moving piece passes over
+    def animateMove(self, move, board, clock):
+        dR = move.end_row - move.start_row
+        dC = move.end_col - move.start_col
+        frames_per_square = 10 # frames to move one square
+        frame_count = (abs(dR) + abs(dC)) * frames_per_square
+        end_piece = board[move.end_row][move.end_col]
+        board[move.end_row][move.end_col] = move.piece_captured if not move.enpassant_move else "--"
+        previous = None
+        for frame in range(frame_count + 1):
+            r,c = (move.start_row + dR*frame/frame_count,move.start_col + dC*frame/frame_count)
+            piece_rect = p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+            area = piece_rect.union(previous) if previous is not None else piece_rect
+            rects = [self.drawSquare(board, row, col, {})
+                     for row in range(int(area.top // SQ_SIZE), min(DIMENSION, (area.bottom - 1) // SQ_SIZE + 1))
+                     for col in range(int(area.left // SQ_SIZE), min(DIMENSION, (area.right - 1) // SQ_SIZE + 1))]
+            self.screen.blit(IMAGES[move.piece_moved], piece_rect)
+            p.display.update(rects)
+            previous = piece_rect
+            clock.tick(60)
+        # the start and end squares differ from what draw() last put on screen, so they are redrawn next frame
+        board[move.end_row][move.end_col] = end_piece
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Play chess")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="logic", help="position engine to use")
+    parser.add_argument("--renderer", choices=["dirty", "full"], default="dirty",
+                        help="redraw only changed squares, or the whole board every frame")
+    parser.add_argument("--fps", type=int, default=MAX_FPS, help="frame rate cap")
+    parser.add_argument("--book", help="opening book, press 'b' to play a book move")
+    parser.add_argument("--profile", action="store_true", help="show move generation time and call counts")
+    parser.add_argument("--tablebase", help="endgame tables directory, press 't' to play the table move")
+    args = parser.parse_args()
+    main(args.backend, args.renderer, args.fps, args.book, args.profile, args.tablebase)
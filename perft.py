@@ -0,0 +1,160 @@
+import argparse
+import sys
+import time
+import tracemalloc
+
+from bitboard import BitboardLogic
+from logic import Logic
+
+BACKENDS = {"logic": Logic, "bitboard": BitboardLogic}
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# Reference positions with known node counts per depth (depth 1 first)
+# https://www.chessprogramming.org/Perft_Results
+POSITIONS = {
+    "start": (START_FEN, [20, 400, 8902, 197281]),
+    "kiwipete": ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+                 [48, 2039, 97862]),
+    "enpassant": ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238]),
+    "promotion": ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+                  [6, 264, 9467]),
+    "castling": ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [44, 1486, 62379]),
+    "middlegame": ("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+                   [46, 2079, 89890]),
+}
+
+
+# Count the leaf nodes of the legal move tree to the given depth
+def perft(game_state, depth):
+    if depth == 0:
+        return 1
+    moves = game_state.validMoves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        game_state.makeMove(move)
+        nodes += perft(game_state, depth - 1)
+        game_state.undoMove()
+    return nodes
+
+
+# Split the node count per root move (ex. {"e2e4": 600, ...})
+def divide(game_state, depth):
+    counts = {}
+    for move in game_state.validMoves():
+        game_state.makeMove(move)
+        counts[move.getUCI()] = perft(game_state, depth - 1)
+        game_state.undoMove()
+    return counts
+
+
+# Time a perft run, returns (nodes, seconds)
+def timedPerft(fen, depth, backend=Logic, pin_aware=True):
+    game_state = backend()
+    game_state.pin_aware = pin_aware
+    game_state.loadFEN(fen)
+    start = time.perf_counter()
+    nodes = perft(game_state, depth)
+    return nodes, time.perf_counter() - start
+
+
+# Run every reference position up to max_depth, returns the number of mismatches
+def runSuite(max_depth, backend=Logic, pin_aware=True, out=sys.stdout):
+    failures = 0
+    for name, (fen, expected) in POSITIONS.items():
+        for depth in range(1, min(max_depth, len(expected)) + 1):
+            nodes, seconds = timedPerft(fen, depth, backend, pin_aware)
+            status = "ok" if nodes == expected[depth - 1] else "FAIL (expected %d)" % expected[depth - 1]
+            if nodes != expected[depth - 1]:
+                failures += 1
+            print("%-10s depth %d: %9d nodes %8.2fs %9.0f nps  %s"
+                  % (name, depth, nodes, seconds, nodes / max(seconds, 1e-9), status), file=out)
+    return failures
+
+
+# Make/unmake microbenchmark: every legal move of the position made and taken back `rounds` times,
+# then the memory traced while trying all moves once and while playing a line of `plies` moves
+# Returns (make/unmake pairs per second, bytes allocated by one round, bytes kept per ply played)
+def makeUnmakeBench(game_state, rounds=1000, plies=200):
+    moves = game_state.validMoves()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for move in moves:
+            game_state.makeMove(move)
+            game_state.undoMove()
+    seconds = max(time.perf_counter() - start, 1e-9)
+    line = []
+    for ply in range(plies): # deterministic line, stops early when the game ends
+        line_moves = game_state.validMoves()
+        if not line_moves:
+            break
+        line.append(line_moves[ply % len(line_moves)])
+        game_state.makeMove(line[-1])
+    for _ in line:
+        game_state.undoMove()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    for move in moves:
+        game_state.makeMove(move)
+        game_state.undoMove()
+    round_bytes = tracemalloc.get_traced_memory()[1] - base
+    base = tracemalloc.get_traced_memory()[0]
+    for move in line:
+        game_state.makeMove(move)
+    ply_bytes = (tracemalloc.get_traced_memory()[0] - base) / max(len(line), 1)
+    tracemalloc.stop()
+    for _ in line:
+        game_state.undoMove()
+    return rounds * len(moves) / seconds, round_bytes, ply_bytes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft node counts and move generation benchmark")
+    parser.add_argument("--fen", default=START_FEN, help="position to search (default: start position)")
+    parser.add_argument("--position", choices=sorted(POSITIONS), help="use one of the reference positions")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--divide", action="store_true", help="print the node count per root move")
+    parser.add_argument("--suite", action="store_true", help="check all reference positions up to --depth")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="logic", help="position engine to test")
+    parser.add_argument("--check-hash", action="store_true",
+                        help="verify the incremental zobrist key against a full recompute on every move")
+    parser.add_argument("--check-eval", action="store_true",
+                        help="verify the incremental evaluation against a full recompute on every move")
+    parser.add_argument("--filter", action="store_true",
+                        help="use the make/undo filtering generator of Logic instead of the pin-aware one")
+    parser.add_argument("--bench-make", action="store_true",
+                        help="measure make/unmake throughput and memory per ply instead of counting nodes")
+    args = parser.parse_args(argv)
+
+    if args.suite:
+        failures = runSuite(args.depth, BACKENDS[args.backend], not args.filter)
+        print("%d mismatches" % failures)
+        return 1 if failures else 0
+
+    fen = POSITIONS[args.position][0] if args.position else args.fen
+    game_state = BACKENDS[args.backend]()
+    game_state.pin_aware = not args.filter
+    game_state.debug_hash = args.check_hash
+    game_state.debug_eval = args.check_eval
+    game_state.loadFEN(fen)
+    if args.bench_make:
+        pairs, round_bytes, ply_bytes = makeUnmakeBench(game_state)
+        print("make/unmake %.0f/s  %d bytes allocated trying every move  %.0f bytes kept per ply"
+              % (pairs, round_bytes, ply_bytes))
+        return 0
+    start = time.perf_counter()
+    if args.divide:
+        counts = divide(game_state, args.depth)
+        for uci in sorted(counts):
+            print("%s: %d" % (uci, counts[uci]))
+        nodes = sum(counts.values())
+    else:
+        nodes = perft(game_state, args.depth)
+    seconds = time.perf_counter() - start
+    print("nodes %d  time %.2fs  nps %.0f" % (nodes, seconds, nodes / max(seconds, 1e-9)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+import argparse
+import mmap
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from logic import Logic
+from logic import Move
+
+TAG_RE = re.compile(r'\[(\w+)\s+"((?:[^"\\]|\\.)*)"\]')
+# Comments, variations (one level of nesting per pass), NAGs and move numbers are dropped from movetext
+COMMENT_RE = re.compile(r"\{[^}]*\}|;[^\n]*")
+VARIATION_RE = re.compile(r"\([^()]*\)")
+NOISE_RE = re.compile(r"\$\d+|\d+\.(\.\.)?")
+RESULTS = {"1-0", "0-1", "1/2-1/2", "*"}
+# Reference games and the plies each must replay, checked by --check
+CHECK_GAMES = [
+    ("1. e4 e5 ; king pawn\n2. Nf3 Nc6 3. Bb5 a6 *", 6),
+    ("1. e4 {a comment\nover two lines} e5 2. Nf3 (2. f4 exf4 (2... d5)) Nc6 $1 3. Bc4 *", 5),
+    ('[FEN "4k3/1P6/8/3pP3/8/8/8/4K3 w - d6 0 1"]\n\n1. exd6 Kd7 2. b8=N+ Kxd6 *', 4),
+    ("1. e4 e5 2. Nf3 Nc6 3. Bc4 Nf6 4. O-O Nxe4 5. Re1 d5 6. Bxd5 Qxd5 7. Nc3 Qa5 ; Italian\n"
+     "8. Nxe4 Be6 9. Neg5 O-O-O 1-0", 18),
+]
+SAN_RE = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$")
+
+
+class PGNError(Exception):
+    pass
+
+
+class GameResult():
+
+    def __init__(self, tags):
+        self.tags = tags
+        self.moves = [] # coordinate notation of every ply played
+        self.positions = [] # FEN after every ply (only when requested)
+        self.final_fen = None
+        self.error = None # description of the first bad move, None when the game replayed cleanly
+
+    def plies(self):
+        return len(self.moves)
+
+
+# Lines of a PGN source: a path (optionally memory-mapped) or an open binary/text file
+def _lines(source, use_mmap=False):
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            if use_mmap:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    for line in iter(mm.readline, b""):
+                        yield line.decode("utf-8", "replace")
+            else:
+                for line in f:
+                    yield line.decode("utf-8", "replace")
+    else:
+        for line in source:
+            yield line.decode("utf-8", "replace") if isinstance(line, bytes) else line
+
+
+# Stream (tags, movetext) pairs one game at a time, never holding more than one game in memory
+def readGames(source, use_mmap=False):
+    tags = {}
+    movetext = []
+    for line in _lines(source, use_mmap):
+        line = line.strip()
+        if line.startswith("["):
+            if movetext: # a tag after movetext starts the next game (lines stay apart so ; comments end)
+                yield tags, "\n".join(movetext)
+                tags, movetext = {}, []
+            match = TAG_RE.match(line)
+            if match:
+                tags[match.group(1)] = match.group(2)
+        elif line and not line.startswith("%"):
+            movetext.append(line)
+    if tags or movetext:
+        yield tags, "\n".join(movetext)
+
+
+# SAN tokens of the main line
+def sanTokens(movetext):
+    text = COMMENT_RE.sub(" ", movetext)
+    previous = None
+    while previous != text: # strip nested variations from the inside out
+        previous = text
+        text = VARIATION_RE.sub(" ", text)
+    text = NOISE_RE.sub(" ", text)
+    return [token for token in text.split() if token not in RESULTS]
+
+
+# Find the legal move matching a SAN string (ex. Nbd7, exd6, e8=Q, O-O)
+def resolveSAN(game_state, san, moves=None):
+    if moves is None:
+        moves = game_state.validMoves()
+    san = san.rstrip("+#!?")
+    if san in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        end_col = 6 if len(san) == 3 else 2
+        for move in moves:
+            if move.castle_move and move.end_col == end_col:
+                return move
+        raise PGNError("illegal castle " + san)
+    match = SAN_RE.match(san)
+    if not match:
+        raise PGNError("unreadable move " + san)
+    kind, from_file, from_rank, destination, promotion = match.groups()
+    kind = kind or "P"
+    end_row = Move.ranks_to_rows[destination[1]]
+    end_col = Move.files_to_cols[destination[0]]
+    found = None
+    for move in moves:
+        if move.end_row != end_row or move.end_col != end_col or move.piece_moved[1] != kind or move.castle_move:
+            continue
+        if from_file and move.start_col != Move.files_to_cols[from_file]:
+            continue
+        if from_rank and move.start_row != Move.ranks_to_rows[from_rank]:
+            continue
+        if move.pawn_promotion and move.promotion_piece != (promotion or "Q"):
+            continue
+        if found is not None:
+            raise PGNError("ambiguous move " + san)
+        found = move
+    if found is None:
+        raise PGNError("illegal move " + san)
+    return found
+
+
+# Play one game through Logic, stopping at the first move that does not resolve
+def replayGame(tags, movetext, positions=False):
+    result = GameResult(tags)
+    game_state = Logic()
+    if "FEN" in tags:
+        game_state.loadFEN(tags["FEN"])
+    for ply, san in enumerate(sanTokens(movetext)):
+        try:
+            move = resolveSAN(game_state, san)
+        except PGNError as e:
+            result.error = "ply %d: %s" % (ply + 1, e)
+            break
+        game_state.makeMove(move)
+        result.moves.append(move.getUCI())
+        if positions:
+            result.positions.append(game_state.getFEN())
+    result.final_fen = game_state.getFEN()
+    return result
+
+
+def _replayBatch(batch):
+    return [replayGame(tags, movetext, positions) for tags, movetext, positions in batch]
+
+
+def _batches(games, positions, size):
+    batch = []
+    for tags, movetext in games:
+        batch.append((tags, movetext, positions))
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Replay every game of a PGN source, yielding a GameResult per game in file order
+# With workers > 1 batches of games are spread over a process pool with a bounded number in flight
+def replayGames(source, use_mmap=False, positions=False, workers=1, batch_size=64):
+    games = readGames(source, use_mmap)
+    if workers <= 1:
+        for tags, movetext in games:
+            yield replayGame(tags, movetext, positions)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        for batch in _batches(games, positions, batch_size):
+            pending.append(executor.submit(_replayBatch, batch))
+            if len(pending) >= 2 * workers:
+                for result in pending.pop(0).result():
+                    yield result
+        for future in pending:
+            for result in future.result():
+                yield result
+
+
+# Replay every reference game, returns the number that stopped early or at the wrong ply
+def checkGames(out=sys.stdout):
+    failures = 0
+    for i, (text, expected) in enumerate(CHECK_GAMES):
+        results = list(replayGames(text.splitlines(True)))
+        plies = results[0].plies() if len(results) == 1 else -1
+        error = results[0].error if len(results) == 1 else "%d games read" % len(results)
+        status = "ok" if plies == expected and not error else "FAIL (expected %d plies)" % expected
+        if status != "ok":
+            failures += 1
+        print("game %d: %d plies%s  %s" % (i + 1, plies, ", " + error if error else "", status), file=out)
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay and validate the games of a PGN file")
+    parser.add_argument("pgn", nargs="?", help="PGN file, - for standard input")
+    parser.add_argument("--mmap", action="store_true", help="memory-map the file instead of buffered reads")
+    parser.add_argument("--workers", type=int, default=1, help="replay games in this many processes")
+    parser.add_argument("--positions", action="store_true", help="print the FEN after every ply")
+    parser.add_argument("--quiet", action="store_true", help="only print errors and the summary")
+    parser.add_argument("--check", action="store_true", help="replay the built-in reference games instead")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        failures = checkGames()
+        print("%d mismatches" % failures)
+        return 1 if failures else 0
+    if args.pgn is None:
+        parser.error("a PGN file is required without --check")
+
+    source = sys.stdin.buffer if args.pgn == "-" else args.pgn
+    games = plies = errors = 0
+    start = time.perf_counter()
+    for result in replayGames(source, args.mmap, args.positions, args.workers):
+        games += 1
+        plies += result.plies()
+        if result.error:
+            errors += 1
+            print("game %d (%s - %s): %s" % (games, result.tags.get("White", "?"),
+                                             result.tags.get("Black", "?"), result.error))
+        elif not args.quiet:
+            for fen in result.positions:
+                print(fen)
+            print("game %d: %d plies, final position %s" % (games, result.plies(), result.final_fen))
+    seconds = max(time.perf_counter() - start, 1e-9)
+    print("%d games, %d plies, %d errors in %.2fs: %.1f games/sec, %.0f plies/sec"
+          % (games, plies, errors, seconds, games / seconds, plies / seconds))
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+import argparse
+import functools
+import random
+import sys
+import time
+from collections import deque
+
+from logic import Logic
+from logic import Move
+from perft import BACKENDS
+from perft import POSITIONS
+from perft import START_FEN
+from perft import perft
+
+# Opt-in instrumentation of a backend: while a Profiler is enabled the methods below are replaced by
+# counting and timing wrappers on the class of the backend's MRO that defines them (so a subclass
+# override that chains to Logic counts once), and the originals are put back by disable(), so nothing
+# is paid when profiling is off
+LOGIC_METHODS = ["validMoves", "generateMoves", "legalMoves", "filteredMoves", "possibleMoves",
+                 "checksAndPins", "getLegalKingMoves", "inCheck", "squareUnderAttack", "attackedSquares",
+                 "getPawnMoves", "getRookMoves", "getKnightMoves", "getBishopMoves", "getQueenMoves",
+                 "getKingMoves", "getSlidingMoves", "getCastleMoves", "makeMove", "undoMove"]
+# Methods only BitboardLogic has
+BITBOARD_METHODS = ["attackersOf", "squareAttacked", "toggleMove", "_pawnMoves", "_enpassantLegal"]
+
+
+class RootCall():
+    __slots__ = ("name", "seconds", "moves", "calls", "times")
+
+    def __init__(self, name, seconds, moves, calls, times):
+        self.name = name # outermost instrumented method, ex. validMoves called by the GUI
+        self.seconds = seconds
+        self.moves = moves # length of the list it returned, None for other results
+        self.calls = calls # {name: calls made during this root call, itself included}
+        self.times = times # {name: seconds spent in name during this root call}
+
+
+class Profiler():
+    active = None # the enabled profiler, only one can patch Logic at a time
+
+    def __init__(self, max_roots=10000, backend=Logic):
+        self.backend = backend # Logic or a subclass of it
+        self.roots = deque(maxlen=max_roots)
+        self.originals = {}
+        self.reset()
+
+    def reset(self):
+        self.calls = {} # totals over every root call
+        self.times = {}
+        self.roots.clear()
+        self.depth = 0
+        self.root_calls = {}
+        self.root_times = {}
+
+    def enable(self):
+        if Profiler.active is not None:
+            raise RuntimeError("a profiler is already enabled")
+        Profiler.active = self
+        for name in LOGIC_METHODS + BITBOARD_METHODS:
+            for owner in self.backend.__mro__:
+                if name in owner.__dict__:
+                    self.patch(owner, name, name)
+                    break
+        self.patch(Move, "__init__", "Move") # Move() and Move.fromSquares both count as "Move"
+        self.originals[(Move, "fromSquares")] = Move.__dict__["fromSquares"]
+        Move.fromSquares = classmethod(self.wrap("Move", Move.__dict__["fromSquares"].__func__))
+        # move_functions holds the generators themselves, not class attributes
+        self.original_move_functions = dict(Logic.move_functions)
+        for piece, function in self.original_move_functions.items():
+            Logic.move_functions[piece] = Logic.__dict__[function.__name__]
+        return self
+
+    def disable(self):
+        for (owner, attribute), original in self.originals.items():
+            setattr(owner, attribute, original)
+        self.originals = {}
+        Logic.move_functions.update(self.original_move_functions)
+        Profiler.active = None
+
+    def __enter__(self):
+        return self.enable()
+
+    def __exit__(self, *exc_info):
+        self.disable()
+
+    def patch(self, owner, attribute, name):
+        original = owner.__dict__[attribute]
+        self.originals[(owner, attribute)] = original
+        setattr(owner, attribute, self.wrap(name, original))
+
+    def wrap(self, name, function):
+        profiler = self
+        perf_counter = time.perf_counter
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            profiler.depth += 1
+            start = perf_counter()
+            result = None
+            try:
+                result = function(*args, **kwargs)
+                return result
+            finally:
+                seconds = perf_counter() - start
+                profiler.depth -= 1
+                profiler.root_calls[name] = profiler.root_calls.get(name, 0) + 1
+                profiler.root_times[name] = profiler.root_times.get(name, 0.0) + seconds
+                if profiler.depth == 0:
+                    profiler.endRoot(name, seconds, len(result) if isinstance(result, list) else None)
+        return wrapper
+
+    def endRoot(self, name, seconds, moves):
+        for counter, calls in self.root_calls.items():
+            self.calls[counter] = self.calls.get(counter, 0) + calls
+            self.times[counter] = self.times.get(counter, 0.0) + self.root_times[counter]
+        self.roots.append(RootCall(name, seconds, moves, self.root_calls, self.root_times))
+        self.root_calls = {}
+        self.root_times = {}
+
+    # Most recent root call, optionally only among those of one method
+    def lastRoot(self, name=None):
+        for root in reversed(self.roots):
+            if name is None or root.name == name:
+                return root
+        return None
+
+    # {name: (calls, seconds)} over every finished root call
+    def counters(self):
+        return {name: (calls, self.times[name]) for name, calls in self.calls.items()}
+
+    # Per root method: how often it ran, its mean time and the mean calls of every counter per root call
+    # and per move it returned (a count per move that grows with the move count is a regression)
+    def report(self, out=sys.stdout):
+        by_root = {}
+        for root in self.roots:
+            by_root.setdefault(root.name, []).append(root)
+        for name in sorted(by_root, key=lambda name: -sum(root.seconds for root in by_root[name])):
+            roots = by_root[name]
+            moves = sum(root.moves or 0 for root in roots)
+            print("%s: %d root calls, %.3f ms mean%s" % (
+                name, len(roots), 1000 * sum(root.seconds for root in roots) / len(roots),
+                ", %.1f moves mean" % (moves / len(roots)) if moves else ""), file=out)
+            calls = {}
+            times = {}
+            for root in roots:
+                for counter, count in root.calls.items():
+                    calls[counter] = calls.get(counter, 0) + count
+                    times[counter] = times.get(counter, 0.0) + root.times[counter]
+            print("    %-18s %12s %12s %10s %10s" % ("", "calls", "total ms", "per root", "per move"), file=out)
+            for counter in sorted(calls, key=lambda counter: -times[counter]):
+                print("    %-18s %12d %12.1f %10.2f %10s" % (
+                    counter, calls[counter], 1000 * times[counter], calls[counter] / len(roots),
+                    "%.2f" % (calls[counter] / moves) if moves else "-"), file=out)
+
+
+# Play random games, one validMoves root call per ply as in the GUI
+def randomGames(game_state, games, plies, seed=0):
+    rng = random.Random(seed)
+    fen = game_state.getFEN()
+    for _ in range(games):
+        game_state.loadFEN(fen)
+        for _ in range(plies):
+            moves = game_state.validMoves()
+            if not moves:
+                break
+            game_state.makeMove(rng.choice(moves))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count and time Logic calls per root call")
+    parser.add_argument("--fen", default=START_FEN, help="position to start from (default: start position)")
+    parser.add_argument("--position", choices=sorted(POSITIONS), help="use one of the perft reference positions")
+    parser.add_argument("--depth", type=int, default=3, help="perft depth to profile")
+    parser.add_argument("--games", type=int, help="profile this many random games instead of perft")
+    parser.add_argument("--plies", type=int, default=100, help="plies per random game")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="logic", help="position engine to profile")
+    parser.add_argument("--filter", action="store_true",
+                        help="use the make/undo filtering generator of Logic instead of the pin-aware one")
+    args = parser.parse_args(argv)
+
+    game_state = BACKENDS[args.backend]()
+    game_state.pin_aware = not args.filter
+    game_state.loadFEN(POSITIONS[args.position][0] if args.position else args.fen)
+    with Profiler(backend=BACKENDS[args.backend]) as profiler:
+        if args.games:
+            randomGames(game_state, args.games, args.plies)
+        else:
+            perft(game_state, args.depth)
+    profiler.report()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+import argparse
+import importlib
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from logic import Logic
+
+# Headless games between move pickers, driving Logic directly (no pygame)
+# A picker is a function (game_state, valid_moves, rng, options) -> move
+
+
+def randomPicker(game_state, valid_moves, rng, options):
+    return rng.choice(valid_moves)
+
+
+# Best move one ply deep by static evaluation, ties broken at random
+def greedyPicker(game_state, valid_moves, rng, options):
+    best_score = None
+    best_moves = []
+    for move in valid_moves:
+        game_state.makeMove(move)
+        score = -game_state.evaluate()
+        game_state.undoMove()
+        if best_score is None or score > best_score:
+            best_score = score
+            best_moves = [move]
+        elif score == best_score:
+            best_moves.append(move)
+    return rng.choice(best_moves)
+
+
+def searchPicker(game_state, valid_moves, rng, options):
+    import engine
+    result = engine.search(game_state, options.get("depth"), options.get("time_limit"))
+    return result.best_move
+
+
+PICKERS = {"random": randomPicker, "greedy": greedyPicker, "search": searchPicker}
+
+
+# Picker by name, or any importable "module:function"
+def getPicker(name):
+    if name in PICKERS:
+        return PICKERS[name]
+    module, _, function = name.partition(":")
+    return getattr(importlib.import_module(module), function)
+
+
+_books = {} # opening books opened by this process, by path
+
+
+def getBook(path):
+    if path not in _books:
+        from book import OpeningBook
+        _books[path] = OpeningBook(path)
+    return _books[path]
+
+
+# Play one game, returns a compact result record
+def playGame(job):
+    index, white, black, seed, max_plies, options = job
+    rng = random.Random(seed)
+    pickers = (getPicker(white), getPicker(black))
+    book = getBook(options["book"]) if options.get("book") else None
+    game_state = Logic()
+    moves = []
+    termination = "max plies"
+    result = "*"
+    while len(moves) < max_plies:
+        valid_moves = game_state.validMoves()
+        if game_state.check_mate:
+            termination = "checkmate"
+            result = "0-1" if game_state.white_to_move else "1-0"
+            break
+        if game_state.stale_mate:
+            termination = "stalemate"
+            result = "1/2-1/2"
+            break
+        draw_reason = game_state.drawReason()
+        if draw_reason is not None:
+            termination = draw_reason
+            result = "1/2-1/2"
+            break
+        move = book.pickMove(game_state, rng) if book is not None else None
+        if move is None: # out of book
+            picker = pickers[0] if game_state.white_to_move else pickers[1]
+            move = picker(game_state, valid_moves, rng, options)
+        game_state.makeMove(move)
+        moves.append(move.getUCI())
+    return {"game": index, "white": white, "black": black, "seed": seed, "result": result,
+            "termination": termination, "plies": len(moves), "moves": " ".join(moves)}
+
+
+# Play games over a process pool, yielding results as they finish (in game order)
+def playGames(games, white, black, seed=0, max_plies=300, workers=1, options=None):
+    jobs = ((i, white, black, seed + i, max_plies, options or {}) for i in range(games))
+    if workers <= 1:
+        for job in jobs:
+            yield playGame(job)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(playGame, jobs, chunksize=4):
+            yield result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless self-play between move pickers")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--white", default="random", help="random, greedy, search or module:function")
+    parser.add_argument("--black", default="random", help="random, greedy, search or module:function")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-plies", type=int, default=300, help="adjourn games that run longer")
+    parser.add_argument("--depth", type=int, default=2, help="depth for the search picker")
+    parser.add_argument("--time", type=float, help="time per move for the search picker")
+    parser.add_argument("--book", help="opening book both sides play from before their pickers")
+    parser.add_argument("--output", default="-", help="JSON lines file for the game records (- for stdout)")
+    args = parser.parse_args(argv)
+
+    options = {"depth": args.depth, "time_limit": args.time, "book": args.book}
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    games = plies = 0
+    outcomes = {}
+    start = time.perf_counter()
+    try:
+        for record in playGames(args.games, args.white, args.black, args.seed, args.max_plies,
+                                args.workers, options):
+            out.write(json.dumps(record, separators=(",", ":")) + "\n")
+            games += 1
+            plies += record["plies"]
+            outcomes[record["result"]] = outcomes.get(record["result"], 0) + 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    seconds = max(time.perf_counter() - start, 1e-9)
+    print("%d games, %d plies in %.2fs: %.2f games/sec, %.0f plies/sec  %s"
+          % (games, plies, seconds, games / seconds, plies / seconds,
+             " ".join("%s:%d" % item for item in sorted(outcomes.items()))), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import resource
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import engine
+from logic import Logic
+from logic import Move
+
+# Line protocol, one reply line per command ("ok ..." or "error ..."):
+#   new [fen]            start a game, replies with its id
+#   move <id> <uci>      play a move in coordinate notation (ex. e2e4, e7e8q)
+#   moves <id>           legal moves of the side to move
+#   fen <id>             current position
+#   undo <id>            take back the last move
+#   engine <id> [depth]  let the engine play a move
+#   close <id>           drop a game
+#   stats                games, latency percentiles and memory of this process
+#   quit                 close the connection
+
+LATENCY_SAMPLES = 10000 # request latencies kept for the percentiles
+
+
+class ProtocolError(Exception):
+    pass
+
+
+# Split coordinate notation into (start_row, start_col, end_row, end_col, promotion_piece)
+def parseUCI(uci):
+    if len(uci) not in (4, 5) or uci[0] not in Move.files_to_cols or uci[2] not in Move.files_to_cols \
+            or uci[1] not in Move.ranks_to_rows or uci[3] not in Move.ranks_to_rows:
+        raise ProtocolError("unreadable move " + uci)
+    promotion = uci[4].upper() if len(uci) == 5 else None
+    if promotion is not None and promotion not in Move.promotion_pieces:
+        raise ProtocolError("unreadable move " + uci)
+    return (Move.ranks_to_rows[uci[1]], Move.files_to_cols[uci[0]],
+            Move.ranks_to_rows[uci[3]], Move.files_to_cols[uci[2]], promotion)
+
+
+# Legal move matching coordinate notation, None when there is none
+def findMove(valid_moves, uci):
+    start_row, start_col, end_row, end_col, promotion = parseUCI(uci)
+    for move in valid_moves:
+        if move.start_row == start_row and move.start_col == start_col \
+                and move.end_row == end_row and move.end_col == end_col \
+                and (not move.pawn_promotion or move.promotion_piece == (promotion or "Q")):
+            return move
+    return None
+
+
+# Runs in the engine process pool, the position travels as FEN
+def _engineJob(job):
+    fen, depth, time_limit = job
+    game_state = Logic()
+    game_state.loadFEN(fen)
+    result = engine.search(game_state, depth, time_limit)
+    return result.best_move.getUCI() if result.best_move is not None else None
+
+
+# Reject FENs Logic can't play from: bad piece letters, ranks that aren't 8 squares, missing kings,
+# pawns on the first or last rank
+def checkFEN(fen):
+    fields = fen.split()
+    ranks = fields[0].split("/")
+    if len(ranks) != 8 or any(sum(int(char) if char.isdigit() else 1 for char in rank) != 8 for rank in ranks) \
+            or any(not char.isdigit() and char not in "PNBRQKpnbrqk" for rank in ranks for char in rank) \
+            or fields[0].count("K") != 1 or fields[0].count("k") != 1 \
+            or any(char in "Pp" for char in ranks[0] + ranks[7]):
+        raise ProtocolError("bad fen " + fen)
+    if len(fields) > 1 and fields[1] not in ("w", "b") or len(fields) > 3 and fields[3] != "-" and (
+            len(fields[3]) != 2 or fields[3][0] not in Move.files_to_cols or fields[3][1] not in "36"):
+        raise ProtocolError("bad fen " + fen)
+    if any(not field.isdigit() for field in fields[4:6]):
+        raise ProtocolError("bad fen " + fen)
+
+
+class Game():
+    __slots__ = ("game_state", "lock", "valid_moves")
+
+    def __init__(self, fen=None):
+        self.game_state = Logic()
+        if fen:
+            checkFEN(fen)
+            self.game_state.loadFEN(fen)
+        self.lock = asyncio.Lock() # one command at a time per game, other games keep going
+        self.valid_moves = None # legal moves of the current position, None until generated
+
+    # Legal moves, generated once per position (call from an executor thread)
+    def legalMoves(self):
+        if self.valid_moves is None:
+            self.valid_moves = self.game_state.validMoves()
+        return self.valid_moves
+
+    # Play a move and return the status of the new position (call from an executor thread, it
+    # generates the legal moves of the new position)
+    def play(self, uci):
+        move = findMove(self.legalMoves(), uci)
+        if move is None:
+            raise ProtocolError("illegal move " + uci)
+        self.game_state.makeMove(move)
+        self.valid_moves = None
+        return self.status()
+
+    # Game status: checkmate, stalemate, a draw reason or "playing"
+    def status(self):
+        self.legalMoves()
+        game_state = self.game_state
+        if game_state.check_mate:
+            return "checkmate"
+        if game_state.stale_mate:
+            return "stalemate"
+        draw_reason = game_state.drawReason()
+        return draw_reason.replace(" ", "-") if draw_reason else "playing"
+
+    def undo(self):
+        if not self.game_state.move_log:
+            raise ProtocolError("nothing to undo")
+        self.game_state.undoMove()
+        self.valid_moves = None
+
+
+class GameServer():
+
+    def __init__(self, engine_workers=None, depth=3, time_limit=None):
+        self.games = {}
+        self.ids = itertools.count(1)
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.requests = 0
+        self.depth = depth
+        self.time_limit = time_limit
+        self.engine_pool = ProcessPoolExecutor(max_workers=engine_workers)
+
+    def close(self):
+        self.engine_pool.shutdown(wait=False)
+
+    def getGame(self, game_id):
+        try:
+            return self.games[int(game_id)]
+        except (KeyError, ValueError):
+            raise ProtocolError("no game " + game_id)
+
+    # Run a blocking call in the default thread executor so the event loop keeps serving
+    async def offload(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def handleCommand(self, words):
+        command = words[0].lower()
+        if command == "new":
+            game = await self.offload(Game, " ".join(words[1:]))
+            game_id = next(self.ids)
+            self.games[game_id] = game
+            return str(game_id)
+        if command == "stats":
+            return self.stats()
+        if len(words) < 2:
+            raise ProtocolError("missing game id")
+        game = self.getGame(words[1])
+        async with game.lock:
+            if command == "move":
+                if len(words) < 3:
+                    raise ProtocolError("missing move")
+                return await self.offload(game.play, words[2])
+            if command == "moves":
+                return " ".join(move.getUCI() for move in await self.offload(game.legalMoves))
+            if command == "fen":
+                return game.game_state.getFEN()
+            if command == "undo":
+                game.undo()
+                return game.game_state.getFEN()
+            if command == "engine":
+                depth = int(words[2]) if len(words) > 2 else self.depth
+                job = (game.game_state.getFEN(), depth, self.time_limit)
+                uci = await asyncio.get_running_loop().run_in_executor(self.engine_pool, _engineJob, job)
+                if uci is None:
+                    raise ProtocolError("no legal move")
+                return uci + " " + await self.offload(game.play, uci)
+            if command == "close":
+                del self.games[int(words[1])]
+                return "closed"
+        raise ProtocolError("unknown command " + command)
+
+    def stats(self):
+        p50, p90, p99 = percentiles(self.latencies, (50, 90, 99))
+        rss = maxRSS()
+        return "games %d requests %d p50 %.3fms p90 %.3fms p99 %.3fms rss %dkB rss/game %.1fkB" % (
+            len(self.games), self.requests, p50 * 1000, p90 * 1000, p99 * 1000,
+            rss, rss / max(len(self.games), 1))
+
+    async def handleClient(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                words = line.decode("utf-8", "replace").split()
+                if not words:
+                    continue
+                if words[0].lower() == "quit":
+                    break
+                start = time.perf_counter()
+                try:
+                    reply = "ok " + await self.handleCommand(words)
+                except ProtocolError as e: # bad moves, FENs and game ids
+                    reply = "error " + str(e)
+                except Exception as e: # anything else is reported too, the client stays connected
+                    reply = "error %s: %s" % (type(e).__name__, e)
+                self.latencies.append(time.perf_counter() - start)
+                self.requests += 1
+                writer.write((reply + "\n").encode())
+                await writer.drain()
+        finally:
+            writer.close()
+
+
+# Nearest-rank percentiles of a sample, zeros when it is empty
+def percentiles(samples, ranks):
+    ordered = sorted(samples)
+    if not ordered:
+        return [0.0 for _ in ranks]
+    return [ordered[min(len(ordered) - 1, len(ordered) * rank // 100)] for rank in ranks]
+
+
+# Peak resident memory of this process in kB
+def maxRSS():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+async def serve(host, port, engine_workers, depth, time_limit):
+    game_server = GameServer(engine_workers, depth, time_limit)
+    server = await asyncio.start_server(game_server.handleClient, host, port)
+    print("serving on %s:%d" % (host, port), file=sys.stderr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        game_server.close()
+
+
+class Client():
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    # Send one command, returns the reply without its "ok" (raises ProtocolError on "error")
+    async def request(self, line):
+        self.writer.write((line + "\n").encode())
+        await self.writer.drain()
+        reply = (await self.reader.readline()).decode().rstrip("\n")
+        status, _, rest = reply.partition(" ")
+        if status != "ok":
+            raise ProtocolError(rest or "connection closed")
+        return rest
+
+    async def close(self):
+        self.writer.write(b"quit\n")
+        self.writer.close()
+
+
+# One client playing random moves in its own games, returns the request latencies it saw
+async def _benchClient(host, port, games, plies, seed, engine_every):
+    rng = random.Random(seed)
+    client = await Client.connect(host, port)
+    latencies = []
+
+    async def timed(line):
+        start = time.perf_counter()
+        reply = await client.request(line)
+        latencies.append(time.perf_counter() - start)
+        return reply
+
+    for _ in range(games):
+        game_id = await timed("new")
+        for ply in range(plies):
+            if engine_every and ply % engine_every == engine_every - 1:
+                status = (await timed("engine %s 1" % game_id)).split()[-1]
+            else:
+                moves = (await timed("moves " + game_id)).split()
+                status = (await timed("move %s %s" % (game_id, rng.choice(moves)))).split()[-1]
+            if status != "playing":
+                break
+    await client.close()
+    return latencies
+
+
+# Start a server in this process and drive it with concurrent local clients
+async def bench(clients, games, plies, engine_every, engine_workers):
+    game_server = GameServer(engine_workers)
+    base_rss = maxRSS()
+    server = await asyncio.start_server(game_server.handleClient, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    start = time.perf_counter()
+    results = await asyncio.gather(*[_benchClient("127.0.0.1", port, games, plies, seed, engine_every)
+                                     for seed in range(clients)])
+    seconds = time.perf_counter() - start
+    latencies = [latency for result in results for latency in result]
+    p50, p90, p99 = percentiles(latencies, (50, 90, 99))
+    print("%d clients, %d requests in %.2fs: %.0f requests/sec" % (clients, len(latencies), seconds,
+                                                                   len(latencies) / seconds))
+    print("client latency p50 %.3fms p90 %.3fms p99 %.3fms" % (p50 * 1000, p90 * 1000, p99 * 1000))
+    print("server " + game_server.stats())
+    print("%.1fkB per game over the process baseline" % ((maxRSS() - base_rss) / max(len(game_server.games), 1)))
+    server.close()
+    await server.wait_closed()
+    game_server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Asyncio server hosting many games over a line protocol")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5050)
+    parser.add_argument("--engine-workers", type=int, default=os.cpu_count(), help="processes for engine moves")
+    parser.add_argument("--depth", type=int, default=3, help="default engine depth")
+    parser.add_argument("--time", type=float, help="engine time limit per move")
+    parser.add_argument("--bench", action="store_true", help="run a local server and benchmark it with clients")
+    parser.add_argument("--clients", type=int, default=50, help="concurrent clients when benchmarking")
+    parser.add_argument("--games", type=int, default=4, help="games per client when benchmarking")
+    parser.add_argument("--plies", type=int, default=40, help="plies per game when benchmarking")
+    parser.add_argument("--engine-every", type=int, default=0, help="let the engine play every n-th ply")
+    args = parser.parse_args(argv)
+
+    if args.bench:
+        asyncio.run(bench(args.clients, args.games, args.plies, args.engine_every, args.engine_workers))
+    else:
+        try:
+            asyncio.run(serve(args.host, args.port, args.engine_workers, args.depth, args.time))
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+
+from logic import Logic
+
+# Endgame tables for king and one piece against a bare king, built by retrograde analysis
+# One entry byte per index: 0 draw, 255 illegal or unused index, otherwise plies to mate + 1
+# (an odd number of plies means the side to move mates, an even number that it gets mated)
+MAGIC = b"CHTB"
+VERSION = 1
+HEADER = struct.Struct(">4sI4sI") # magic, version, table name, entry count
+DRAW = 0
+ILLEGAL = 255
+WIN, LOSS = 1, -1
+TABLES = ("KQK", "KRK", "KPK") # build order, KPK promotes into the other two
+
+# Tables see the position with the strong side as white (moving up the board) and index
+# (strong king, weak king, piece, weak side to move). Without pawns the strong king is mirrored
+# into the a1-d1-d4 triangle, with a pawn the pawn is mirrored onto files a-d
+TRIANGLE = [(7 - y, x) for x in range(4) for y in range(x + 1)] # (row, col) of a1, b1, b2, c1, ...
+TRIANGLE_INDEX = {square: i for i, square in enumerate(TRIANGLE)}
+
+
+def _pawnlessIndex(strong_king, weak_king, piece, weak_to_move):
+    squares = [strong_king, weak_king, piece]
+    r, c = strong_king
+    if c > 3:
+        squares = [(row, 7 - col) for row, col in squares]
+    if r < 4:
+        squares = [(7 - row, col) for row, col in squares]
+    r, c = squares[0]
+    if 7 - r > c: # above the a1-h8 diagonal, reflect over it
+        squares = [(7 - col, 7 - row) for row, col in squares]
+    strong_king, weak_king, piece = squares
+    return ((TRIANGLE_INDEX[strong_king] * 64 + weak_king[0] * 8 + weak_king[1]) * 64
+            + piece[0] * 8 + piece[1]) * 2 + weak_to_move
+
+
+def _pawnIndex(strong_king, weak_king, pawn, weak_to_move):
+    if pawn[1] > 3:
+        strong_king, weak_king, pawn = [(row, 7 - col) for row, col in (strong_king, weak_king, pawn)]
+    return ((((pawn[0] - 1) * 4 + pawn[1]) * 64 + strong_king[0] * 8 + strong_king[1]) * 64
+            + weak_king[0] * 8 + weak_king[1]) * 2 + weak_to_move
+
+
+# (strong king, weak king, piece, weak to move) of every index, in index order
+def _pawnlessPositions():
+    for strong_king in TRIANGLE:
+        for weak_king in range(64):
+            for piece in range(64):
+                for weak_to_move in (0, 1):
+                    yield strong_king, divmod(weak_king, 8), divmod(piece, 8), weak_to_move
+
+
+def _pawnPositions():
+    for pawn in range(24):
+        for strong_king in range(64):
+            for weak_king in range(64):
+                for weak_to_move in (0, 1):
+                    yield divmod(strong_king, 8), divmod(weak_king, 8), (pawn // 4 + 1, pawn % 4), weak_to_move
+
+
+# name: (piece, index function, position generator, entries)
+TABLE_SPECS = {
+    "KQK": ("Q", _pawnlessIndex, _pawnlessPositions, 10 * 64 * 64 * 2),
+    "KRK": ("R", _pawnlessIndex, _pawnlessPositions, 10 * 64 * 64 * 2),
+    "KPK": ("P", _pawnIndex, _pawnPositions, 24 * 64 * 64 * 2),
+}
+
+
+def tableIndex(name, strong_king, weak_king, piece, weak_to_move):
+    return TABLE_SPECS[name][1](strong_king, weak_king, piece, weak_to_move)
+
+
+# Result for the side to move of an entry byte, as (WIN/DRAW/LOSS, plies to mate), None when illegal
+def decode(value):
+    if value == ILLEGAL:
+        return None
+    if value == DRAW:
+        return DRAW, 0
+    plies = value - 1
+    return (WIN if plies % 2 else LOSS), plies
+
+
+# Set up a bare Logic with only the three pieces, strong side white
+def _setUp(game_state, piece, strong_king, weak_king, square, weak_to_move):
+    game_state.board[strong_king[0]][strong_king[1]] = "wK"
+    game_state.board[weak_king[0]][weak_king[1]] = "bK"
+    game_state.board[square[0]][square[1]] = "w" + piece
+    game_state.white_king_location = strong_king
+    game_state.black_king_location = weak_king
+    game_state.white_to_move = not weak_to_move
+
+
+def _clear(game_state, squares):
+    for r, c in squares:
+        game_state.board[r][c] = "--"
+
+
+# Build one table by retrograde analysis, from the checkmates found by Logic.validMoves back to the
+# positions that lead to them. tables holds the entries of already built tables (for promotions)
+def buildTable(name, tables):
+    piece, index_function, positions, size = TABLE_SPECS[name]
+    values = bytearray([ILLEGAL]) * size
+    known = bytearray(size)
+    parents = [None] * size
+    remaining = [0] * size # children not yet known to win for the opponent
+    longest = [0] * size # longest known win among the children played into other tables
+    buckets = [[]] # positions to resolve, by plies to mate
+    game_state = Logic()
+    game_state.board = [["--"] * 8 for _ in range(8)]
+    game_state.castling_rights = 0
+    game_state.enpassant = ()
+
+    def push(plies, index):
+        while len(buckets) <= plies:
+            buckets.append([])
+        buckets[plies].append(index)
+
+    for index, (strong_king, weak_king, square, weak_to_move) in enumerate(positions()):
+        if strong_king == weak_king or square in (strong_king, weak_king) \
+                or abs(strong_king[0] - weak_king[0]) <= 1 and abs(strong_king[1] - weak_king[1]) <= 1:
+            continue
+        _setUp(game_state, piece, strong_king, weak_king, square, weak_to_move)
+        game_state.white_to_move = not game_state.white_to_move
+        in_check = game_state.inCheck() # the side that just moved can't be in check
+        game_state.white_to_move = not game_state.white_to_move
+        if in_check:
+            _clear(game_state, (strong_king, weak_king, square))
+            continue
+        values[index] = DRAW
+        moves = game_state.validMoves()
+        if not moves:
+            if game_state.check_mate:
+                push(0, index)
+            else:
+                known[index] = 1 # stalemate
+            _clear(game_state, (strong_king, weak_king, square))
+            continue
+        remaining[index] = len(moves)
+        for move in moves:
+            end = (move.end_row, move.end_col)
+            child = None
+            if weak_to_move:
+                if move.piece_captured == "--":
+                    child = index_function(strong_king, end, square, 0)
+                # else the bare king took the piece: a draw
+            elif move.piece_moved == "wK":
+                child = index_function(end, weak_king, square, 1)
+            elif not move.pawn_promotion:
+                child = index_function(strong_king, weak_king, end, 1)
+            elif "K%sK" % move.promotion_piece in tables: # the game goes on in another table
+                table = "K%sK" % move.promotion_piece
+                result, plies = decode(tables[table][tableIndex(table, strong_king, weak_king, end, 1)])
+                if result == LOSS:
+                    push(plies + 1, index)
+                elif result == WIN:
+                    remaining[index] -= 1
+                    longest[index] = max(longest[index], plies)
+            # else a bishop or knight promotion: a draw
+            if child is not None:
+                if parents[child] is None:
+                    parents[child] = [index]
+                else:
+                    parents[child].append(index)
+        if remaining[index] == 0: # every move enters another table lost
+            push(longest[index] + 1, index)
+        _clear(game_state, (strong_king, weak_king, square))
+
+    plies = 0
+    while plies < len(buckets):
+        for index in buckets[plies]:
+            if known[index]:
+                continue
+            known[index] = 1
+            values[index] = plies + 1
+            for parent in parents[index] or ():
+                if known[parent]:
+                    continue
+                if plies % 2 == 0: # this position is lost, so moving into it wins
+                    push(plies + 1, parent)
+                else:
+                    remaining[parent] -= 1
+                    if remaining[parent] == 0: # every move loses, as slowly as possible
+                        push(max(plies, longest[parent]) + 1, parent)
+        plies += 1
+    if len(buckets) >= ILLEGAL - 1:
+        raise ValueError("%s: distance to mate does not fit in a byte" % name)
+    return values
+
+
+def writeTable(path, name, values):
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, name.encode().ljust(4, b"\0"), len(values)))
+        f.write(values)
+
+
+class Tablebase():
+
+    # Memory-maps every table file found in the directory
+    def __init__(self, directory):
+        self.files = []
+        self.maps = {}
+        for name in TABLES:
+            path = os.path.join(directory, name + ".tb")
+            if not os.path.exists(path):
+                continue
+            f = open(path, "rb")
+            table = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, table_name, count = HEADER.unpack_from(table, 0)
+            if magic != MAGIC or version != VERSION or table_name.rstrip(b"\0").decode() != name \
+                    or count != TABLE_SPECS[name][3]:
+                raise ValueError("%s is not a %s table" % (path, name))
+            self.files.append(f)
+            self.maps[name] = table
+
+    def close(self):
+        for table in self.maps.values():
+            table.close()
+        for f in self.files:
+            f.close()
+
+    # Result of the position for the side to move as (WIN/DRAW/LOSS, plies to mate),
+    # None when it is not covered by the loaded tables (or is illegal)
+    def probe(self, game_state):
+        if sum(game_state.piece_counts.values()) > 3 or game_state.castling_rights:
+            return None # cheap exit for the search
+        kings = {}
+        pieces = []
+        for r in range(8):
+            for c in range(8):
+                piece = game_state.board[r][c]
+                if piece == "--":
+                    continue
+                if piece[1] == "K":
+                    kings[piece[0]] = (r, c)
+                else:
+                    pieces.append((piece, (r, c)))
+                    if len(pieces) > 1:
+                        return None
+        if len(kings) != 2:
+            return None
+        if not pieces or pieces[0][0][1] in "BN": # bare kings or a lone minor piece can't mate
+            return DRAW, 0
+        piece, square = pieces[0]
+        name = "K%sK" % piece[1]
+        if name not in self.maps:
+            return None
+        strong, weak = piece[0], "b" if piece[0] == "w" else "w"
+        squares = [kings[strong], kings[weak], square]
+        if strong == "b": # mirror so the strong side moves up the board
+            squares = [(7 - r, c) for r, c in squares]
+        weak_to_move = 1 if game_state.white_to_move == (weak == "w") else 0
+        index = tableIndex(name, squares[0], squares[1], squares[2], weak_to_move)
+        return decode(self.maps[name][HEADER.size + index])
+
+    # Best move by the tables: the fastest win, else a draw, else the slowest loss
+    # Returns (move, result, plies to mate) or None when the position is not covered
+    def bestMove(self, game_state):
+        if self.probe(game_state) is None:
+            return None
+        best = None
+        for move in game_state.generateMoves():
+            game_state.makeMove(move)
+            child = self.probe(game_state)
+            game_state.undoMove()
+            if child is None:
+                continue
+            result, plies = -child[0], child[1] + 1 if child[0] != DRAW else 0
+            # rank: wins first (fewest plies), then draws, then losses (most plies)
+            rank = (-result, plies if result == WIN else -plies)
+            if best is None or rank < best[0]:
+                best = (rank, move, result, plies)
+        return best[1:] if best is not None else None
+
+
+def describe(result, plies):
+    if result == DRAW:
+        return "draw"
+    return "%s in %d" % ("mate" if result == WIN else "mated", (plies + 1) // 2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or probe king and piece against king endgame tables")
+    parser.add_argument("directory", help="directory holding the table files")
+    parser.add_argument("--build", action="store_true", help="build the tables into the directory")
+    parser.add_argument("--tables", default=",".join(TABLES), help="tables to build, comma separated")
+    parser.add_argument("--fen", help="position to probe")
+    args = parser.parse_args(argv)
+
+    if args.build:
+        os.makedirs(args.directory, exist_ok=True)
+        tables = {}
+        for name in TABLES:
+            path = os.path.join(args.directory, name + ".tb")
+            if name not in args.tables.split(","):
+                if os.path.exists(path): # already built, needed for promotions
+                    with open(path, "rb") as f:
+                        tables[name] = f.read()[HEADER.size:]
+                continue
+            start = time.perf_counter()
+            values = buildTable(name, tables)
+            writeTable(path, name, values)
+            tables[name] = bytes(values)
+            wins = sum(1 for value in values if value not in (DRAW, ILLEGAL) and value % 2 == 0)
+            losses = sum(1 for value in values if value not in (DRAW, ILLEGAL) and value % 2 == 1)
+            draws = values.count(DRAW)
+            longest = max((value - 1 for value in values if value != ILLEGAL), default=0)
+            print("%s: %d wins, %d draws, %d losses, longest mate %d plies, %d bytes in %.1fs"
+                  % (name, wins, draws, losses, longest, len(values) + HEADER.size, time.perf_counter() - start))
+        return 0
+    tablebase = Tablebase(args.directory)
+    game_state = Logic()
+    if args.fen:
+        game_state.loadFEN(args.fen)
+    probe = tablebase.probe(game_state)
+    if probe is None:
+        print("not in the tables")
+        return 1
+    print(describe(*probe))
+    best = tablebase.bestMove(game_state)
+    if best is not None:
+        print("bestmove %s (%s)" % (best[0].getUCI(), describe(best[1], best[2])))
+    tablebase.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())